@@ -1,3 +1,5 @@
+from typing import Optional
+
 from selenium.common import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webdriver import WebDriver
@@ -7,6 +9,7 @@ from selenium.webdriver.support.wait import WebDriverWait
 from app.consts import ROBLOX_HOME_URL
 from app.repos import UserTokenRepository
 from app.services.driver import presence_of_any_text_in_element, set_token
+from app.services.token_pool import TokenPool
 
 
 def is_authed(driver: WebDriver) -> bool:
@@ -34,24 +37,39 @@ def auth(browser: WebDriver, token: str):
 	browser.refresh()
 
 
-async def auth_browser(driver: WebDriver, token_service: UserTokenRepository) -> None:
+async def auth_browser(
+		driver: WebDriver,
+		token_service: UserTokenRepository,
+		token_pool: Optional[TokenPool] = None,
+) -> Optional[str]:
+	"""
+	Authenticates the driver and returns the token it uses,
+	with token_pool the token is leased from it instead of the database.
+	"""
 	logger.info("First token has been taken")
 
-	tokens = await token_service.fetch_selected_tokens() or await token_service.fetch_active_tokens()
-	if not tokens:
+	if token_pool is not None:
+		token = token_pool.lease()
+	else:
+		tokens = await token_service.fetch_selected_tokens() or await token_service.fetch_active_tokens()
+		token = tokens[0] if tokens else None
+	if not token:
 		logger.warning("Tokens are not available running without token!!!")
-		return
-	token = tokens[0]
+		return None
 
 	logger.info("Starting authentication to roblox.com")
 
 	logger.info("Logging in")
 	auth(driver, token)
 	if not is_authed(driver):
-		await token_service.mark_as_inactive(token)
+		if token_pool is not None:
+			token_pool.mark_as_inactive(token)
+		else:
+			await token_service.mark_as_inactive(token)
 
 		logger.warning("Login failed, trying another token!")
 
-		return await auth_browser(driver, token_service)
+		return await auth_browser(driver, token_service, token_pool)
 
 	logger.info("Login complete")
+	return token
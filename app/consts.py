@@ -1,5 +1,8 @@
 ROBLOX_TOKEN_KEY = ".ROBLOSECURITY"
 ROBLOX_HOME_URL = "https://www.roblox.com/home"
+ROBLOX_ECONOMY_URL = "https://economy.roblox.com"
+ROBLOX_AUTH_URL = "https://auth.roblox.com"
+ROBLOX_USERS_URL = "https://users.roblox.com"
 
 DEFAULT_QUEUE_NAME = "url_queue"
 DEFAULT_EXCHANGE_NAME = "url"
@@ -7,6 +10,8 @@ DEFAULT_ROUTING_KEY = DEFAULT_QUEUE_NAME
 DEFAULT_SEND_NAME = DEFAULT_QUEUE_NAME + "_return"
 DEFAULT_SEND_EXCHANGE_NAME = DEFAULT_EXCHANGE_NAME + "_return"
 DEFAULT_THREADS_COUNT = 2
+DEFAULT_DRIVERS_COUNT = 1
+DEFAULT_DRIVER_MAX_USES = 50
 
 TOKEN_RECURSIVE_CHECK = 5
 
@@ -1,9 +1,10 @@
 import asyncio
+import functools
 import json
 from typing import Optional
 
 import pydantic
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientError
 from loguru import logger
 from selenium.common import NoSuchElementException, TimeoutException
 from selenium.webdriver import Chrome
@@ -23,6 +24,12 @@ from app.services.queue.publisher import BasicMessageSender
 from app.schemas import ReturnSignal, StatusCodes, SendError
 from app.schemas import PurchaseData
 from app.services.validators import validate_game_pass_url
+from app.services.purchase import HttpPurchaseEngine, PurchaseEngineError, InsufficientFundsError
+from app.services.token_pool import TokenPool
+from app.services.balance import BalanceLedger
+from app.services.idempotency import ProcessedTransactions, TransactionInProgress
+from app.services.metrics import WorkerMetrics
+from app.services.tracing import Tracer
 
 
 def press_agreement_button(browser: Chrome):
@@ -46,32 +53,87 @@ class UrlHandler(IListener):
         self.config: Optional[Settings] = None
 
         self.token_service: Optional[UserTokenRepository] = None
+        self.token_pool: Optional[TokenPool] = None
+        self.balance_ledger: Optional[BalanceLedger] = None
+        self.metrics: Optional[WorkerMetrics] = None
+        self.tracer = Tracer()
+        # selenium calls block, under AsyncURLConsumer they go to the executor
+        self.offload_driver = False
         self.setupped = False
 
-    async def setup(self):
-        pass
+    def setup(
+            self,
+            token_service: UserTokenRepository,
+            token_pool: Optional[TokenPool] = None,
+            balance_ledger: Optional[BalanceLedger] = None,
+            metrics: Optional[WorkerMetrics] = None,
+            tracer: Optional[Tracer] = None,
+            offload_driver: bool = False,
+    ):
+        self.token_service = token_service
+        self.token_pool = token_pool
+        self.balance_ledger = balance_ledger
+        self.metrics = metrics
+        if tracer is not None:
+            self.tracer = tracer
+        self.offload_driver = offload_driver
+        self.setupped = True
 
     def close(self):
         pass
 
+    @staticmethod
+    def current_token(driver: Chrome) -> Optional[str]:
+        cookie = driver.get_cookie(ROBLOX_TOKEN_KEY)
+        return cookie["value"] if cookie else None
+
+    async def run_driver(self, func, *args):
+        """
+        Вызывает func(*args), с offload_driver в executor-е,
+        чтобы selenium не блокировал loop остальных сообщений.
+        """
+        if not self.offload_driver:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
     async def get_robuxes(self, driver: Chrome, session: ClientSession) -> int:
+        ledger = self.balance_ledger
+        token = await self.run_driver(self.current_token, driver) if ledger is not None else None
+        if token:
+            robux = ledger.get(token)
+            if robux is not None:
+                return robux
+
+        robux = await self.probe_robuxes(driver, session)
+        if token:
+            ledger.seed(token, robux)
+        return robux
+
+    @staticmethod
+    def wait_robux_amount(driver: Chrome) -> Optional[str]:
         try:
-            # if it's text is ? then it means we cant buy, it means this session can't be used
-            text = WebDriverWait(driver, 3).until(
+            return WebDriverWait(driver, 3).until(
                 presence_of_any_text_in_element((By.ID, "nav-robux-amount"))
             )
-            text = int(text)
         except TimeoutException:
+            return None
+
+    async def probe_robuxes(self, driver: Chrome, session: ClientSession) -> int:
+        text = await self.run_driver(self.wait_robux_amount, driver)
+        if text is None:
             return await self.get_robux_by_request(driver, session)
 
-        return text
-
-    async def get_robux_by_request(self, driver: Chrome, session: ClientSession) -> int:
-        cookies = driver.get_cookies()
-        cookies = convert_browser_cookies_to_aiohttp(cookies)
+        # if it's text is ? then it means we cant buy, it means this session can't be used
+        return int(text)
 
+    @staticmethod
+    def user_data(driver: Chrome) -> tuple:
+        cookies = convert_browser_cookies_to_aiohttp(driver.get_cookies())
         element = driver.find_element(By.CSS_SELECTOR, "meta[name='user-data']")
-        user_id = element.get_attribute("data-userid")
+        return cookies, element.get_attribute("data-userid")
+
+    async def get_robux_by_request(self, driver: Chrome, session: ClientSession) -> int:
+        cookies, user_id = await self.run_driver(self.user_data, driver)
 
         robux_url = "https://economy.roblox.com/v1/users/{user_id}/currency"
 
@@ -84,18 +146,48 @@ class UrlHandler(IListener):
 
             return (await resp.json()).get("robux")
 
+    async def debit_balance(self, driver: Chrome, amount: int) -> None:
+        if self.balance_ledger is None:
+            return
+        token = await self.run_driver(self.current_token, driver)
+        if token:
+            self.balance_ledger.debit(token, amount)
+
+    async def invalidate_balance(self, driver: Chrome) -> None:
+        if self.balance_ledger is None:
+            return
+        token = await self.run_driver(self.current_token, driver)
+        if token:
+            self.balance_ledger.invalidate(token)
+
     async def mark_as_spent(self, driver) -> None:
-        token = driver.get_cookie(ROBLOX_TOKEN_KEY)
-        await self.token_service.mark_as_inactive(token)
+        token = await self.run_driver(self.current_token, driver)
+        if not token:
+            return
+        if self.token_pool is not None:
+            self.token_pool.mark_as_inactive(token)
+        else:
+            await self.token_service.mark_as_inactive(token)
+
+    async def next_token(self) -> Optional[str]:
+        if self.token_pool is not None:
+            return self.token_pool.lease()
+        return await self.token_service.fetch_token()
 
     async def change_token(self, driver) -> None:
         # marks the current token as spent
+        if self.metrics is not None:
+            self.metrics.token_rotations.inc()
         await self.mark_as_spent(driver)
-        driver.delete_cookie(name=ROBLOX_TOKEN_KEY)
-        token = await self.token_service.fetch_token()
+        await self.run_driver(functools.partial(driver.delete_cookie, name=ROBLOX_TOKEN_KEY))
+        token = await self.next_token()
         if not token:
             logger.info("OUT OF TOKENS")
             return
+        await self.run_driver(self.replace_token, driver, token)
+
+    @staticmethod
+    def replace_token(driver: Chrome, token: str) -> None:
         set_token(driver, token)
         driver.refresh()
 
@@ -103,8 +195,8 @@ class UrlHandler(IListener):
         if depth == 0:
             raise RuntimeError("TOKENS CORRUPTED, WAITING FOR ACTIONS")
         await self.change_token(driver)
-        if not is_authed(driver):
-            await self.change_token(driver)
+        if await self.run_driver(is_authed, driver):
+            return
         await self.change_token_recursive(driver, depth - 1)
 
     async def __call__(
@@ -114,8 +206,35 @@ class UrlHandler(IListener):
             settings: Settings,
             publisher: BasicMessageSender,
             data: dict,
-            session: ClientSession
+            session: ClientSession,
+            purchase_engine: Optional[HttpPurchaseEngine] = None,
+            processed: Optional[ProcessedTransactions] = None,
     ) -> None:
+        with self.tracer.span("purchase", purchase_data.tx_id, url=purchase_data.url) as span:
+            try:
+                await self.purchase(driver, purchase_data, settings, data, session, purchase_engine)
+            except BaseException:
+                # DataHandler claimed the transaction, the redelivery has to be able to take it
+                if processed is not None:
+                    try:
+                        await processed.release(purchase_data.tx_id)
+                    except Exception as e:
+                        logger.error(f"Failed to release transaction {purchase_data.tx_id}: {e}")
+                raise
+            if span is not None and "return_signal" in data:
+                span.set(status=data["return_signal"].status_code.name)
+
+    async def purchase(
+            self,
+            driver: Chrome,
+            purchase_data: PurchaseData,
+            settings: Settings,
+            data: dict,
+            session: ClientSession,
+            purchase_engine: Optional[HttpPurchaseEngine] = None,
+    ) -> None:
+        trace = functools.partial(self.tracer.span, trace_id=purchase_data.tx_id)
+
         if not validate_game_pass_url(purchase_data.url):
             logger.info("Not correct url, denying!")
             data.update(
@@ -123,11 +242,32 @@ class UrlHandler(IListener):
             )
             return
 
+        # the api buys with the account of the leased browser,
+        # so token rotation and the balance ledger work the same for both paths
+        token = await self.run_driver(self.current_token, driver) if purchase_engine is not None else None
+        if token:
+            try:
+                with trace("api_purchase"):
+                    return_signal = await purchase_engine.purchase(session, purchase_data, token)
+            except InsufficientFundsError as e:
+                logger.warning(f"Api purchase failed, falling back to browser: {e}")
+                if self.balance_ledger is not None:
+                    self.balance_ledger.invalidate(token)
+            except (PurchaseEngineError, ClientError) as e:
+                logger.warning(f"Api purchase failed, falling back to browser: {e}")
+            else:
+                if return_signal.status_code == StatusCodes.success and self.balance_ledger is not None:
+                    self.balance_ledger.debit(token, purchase_data.price)
+                data.update(return_signal=return_signal)
+                return
+
         logger.info(f"Redirecting to {purchase_data.url}")
-        driver.get(purchase_data.url)
+        with trace("driver.get"):
+            await self.run_driver(driver.get, purchase_data.url)
 
         try:
-            robux = await self.get_robuxes(driver, session)
+            with trace("get_robuxes"):
+                robux = await self.get_robuxes(driver, session)
         except ValueError:
             # не надо волноватся если транзакция улетит в утиль
             # потому как здесь если обработка сообщения прервана
@@ -136,11 +276,12 @@ class UrlHandler(IListener):
             raise
 
         if settings.debug:
-            driver.save_screenshot("screenshot.png")
+            await self.run_driver(driver.save_screenshot, "screenshot.png")
 
-        cost = driver.find_element(By.CLASS_NAME, "text-robux-lg")
-        logger.info(f"Cost of gamepass from page: {cost.text}")
-        if purchase_data.price != int(cost.text.replace(",", "")):
+        with trace("scrape_price"):
+            cost_text = await self.run_driver(lambda: driver.find_element(By.CLASS_NAME, "text-robux-lg").text)
+        logger.info(f"Cost of gamepass from page: {cost_text}")
+        if purchase_data.price != int(cost_text.replace(",", "")):
             logger.info("Price is not equal to url's price")
 
             data.update(
@@ -149,9 +290,10 @@ class UrlHandler(IListener):
 
             return
 
-        if robux < 5 or (int(cost.text.replace(",", "")) > robux and robux < 50):
+        if robux < 5 or (int(cost_text.replace(",", "")) > robux and robux < 50):
             try:
-                await self.change_token_recursive(driver)
+                with trace("change_token_recursive"):
+                    await self.change_token_recursive(driver)
             except RuntimeError:
                 data.update(
                     return_signal=ReturnSignal(
@@ -159,10 +301,11 @@ class UrlHandler(IListener):
                     )
                 )
                 return
-        press_agreement_button(driver)
+        with trace("press_agreement_button"):
+            await self.run_driver(press_agreement_button, driver)
         try:
-            btn = driver.find_element(By.CLASS_NAME, "PurchaseButton")
-            btn.click()
+            with trace("click_purchase"):
+                await self.run_driver(lambda: driver.find_element(By.CLASS_NAME, "PurchaseButton").click())
         except NoSuchElementException:
             logger.info("Gamepass has been already bought")
             _temp = ReturnSignal(
@@ -170,12 +313,20 @@ class UrlHandler(IListener):
             )
             logger.debug("Sending back information about.")
         else:
-            confirm_btn = driver.find_element(By.CSS_SELECTOR, "a#confirm-btn.btn-primary-md")
+            try:
+                confirm_btn = await self.run_driver(
+                    driver.find_element, By.CSS_SELECTOR, "a#confirm-btn.btn-primary-md")
+            except NoSuchElementException:
+                # most likely not enough robuxes, so cached balance was wrong
+                await self.invalidate_balance(driver)
+                raise
             logger.info("Clicking buy now")
             # HERE IT BUYS GAMEPASS
-            confirm_btn.click()
+            with trace("click_confirm"):
+                await self.run_driver(confirm_btn.click)
 
-            logger.info(f"Purchased gamepass for {cost.text} robuxes")
+            logger.info(f"Purchased gamepass for {cost_text} robuxes")
+            await self.debit_balance(driver, purchase_data.price)
             _temp = ReturnSignal(
                 status_code=StatusCodes.success,
             )
@@ -189,7 +340,14 @@ class DataHandler(IListener):
     def close(self, *args, **kwargs):
         pass
 
-    def __call__(self, data: dict, body: bytes, publisher: BasicMessageSender):
+    async def __call__(
+            self,
+            data: dict,
+            body: bytes,
+            publisher: BasicMessageSender,
+            processed: Optional[ProcessedTransactions] = None,
+            metrics: Optional[WorkerMetrics] = None,
+    ):
         try:
             _temp = json.loads(body)
             pur_data = PurchaseData(**_temp)
@@ -204,9 +362,25 @@ class DataHandler(IListener):
 
             data = ReturnSignal(status_code=StatusCodes.invalid_data, errors=errors)
 
+            if metrics is not None:
+                metrics.count_status(data.status_code)
             publisher.send_message(data.dict())
             raise CancelException
 
+        if processed is not None:
+            return_signal = await processed.get(pur_data.tx_id)
+            if return_signal is not None:
+                # redelivered message, the answer is sent again without touching the browser
+                logger.info(f"Transaction {pur_data.tx_id} was already processed")
+                if metrics is not None:
+                    metrics.duplicates.inc()
+                publisher.send_message(return_signal.dict())
+                raise CancelException
+
+            if not await processed.claim(pur_data.tx_id):
+                # another delivery is buying it now, the retry queue brings this one back later
+                raise TransactionInProgress(f"Transaction {pur_data.tx_id} is processed by another delivery")
+
         data.update(purchase_data=pur_data)
 
 
@@ -217,6 +391,18 @@ class ReturnSignalHandler(IListener):
     def close(self, *args, **kwargs):
         pass
 
-    async def __call__(self, publisher: BasicMessageSender,  purchase_data: PurchaseData, return_signal: ReturnSignal):
+    async def __call__(
+            self,
+            publisher: BasicMessageSender,
+            purchase_data: PurchaseData,
+            return_signal: ReturnSignal,
+            processed: Optional[ProcessedTransactions] = None,
+            metrics: Optional[WorkerMetrics] = None,
+    ):
         return_signal.tx_id = purchase_data.tx_id
+        if metrics is not None:
+            metrics.count_status(return_signal.status_code)
+        if processed is not None:
+            # before the ack, so a redelivery of this message is already a duplicate
+            processed.save(purchase_data.tx_id, return_signal)
         publisher.send_message(return_signal.dict())
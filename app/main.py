@@ -1,13 +1,28 @@
+import asyncio
+import functools
+
 from aiohttp import ClientSession
 from dotenv import load_dotenv
 from loguru import logger
+from selenium.webdriver.remote.webdriver import WebDriver
 
 from app.browser import auth_browser
 from app.providers import get_token_service
+from app.repos import UserTokenRepository, ProcessedTransactionRepository
 from app.services.db import get_db_conn
 from app.services.driver import get_driver, convert_browser_cookies_to_aiohttp
-from app.services.queue.consumers import URLConsumer
-from app.settings import get_settings
+from app.services.driver_pool import DriverPool
+from app.services.helpers import run_sync
+from app.services.purchase import HttpPurchaseEngine
+from app.services.token_pool import TokenPool
+from app.services.balance import BalanceLedger, fetch_robux_balance
+from app.services.idempotency import ProcessedTransactions
+from app.services.metrics import WorkerMetrics, MetricsServer
+from app.services.tracing import get_tracer
+from app.consts import ROBLOX_TOKEN_KEY
+from app.services.queue.consumers import URLConsumer, MultiThreadedConsumer, AsyncURLConsumer
+from app.services.queue.publisher import AsyncBatchPublisher
+from app.settings import get_settings, Settings
 from app import handlers
 from app.services.queue.consumers import ReconnectingURLConsumer
 
@@ -15,46 +30,158 @@ import nest_asyncio
 
 from app.logger import configure_logging
 
-nest_asyncio.apply()
+
+def create_driver(
+        settings: Settings,
+        token_service: UserTokenRepository,
+        token_pool: TokenPool,
+        loop: asyncio.AbstractEventLoop,
+) -> WebDriver:
+    driver = get_driver(settings)
+    run_sync(auth_browser(driver, token_service, token_pool), loop)
+    return driver
+
+
+def release_driver_token(token_pool: TokenPool, driver: WebDriver) -> None:
+    try:
+        cookie = driver.get_cookie(ROBLOX_TOKEN_KEY)
+    except Exception:
+        # dead browser, the lease comes back with the next process restart
+        logger.warning("Could not read token of discarded driver")
+        return
+    if cookie:
+        token_pool.release(cookie["value"])
+
+
+async def setup_thread_session(cookies: dict, data: dict) -> None:
+    # aiohttp session is bound to the loop it was created in,
+    # so every thread gets its own one
+    data.update(session=ClientSession(cookies=cookies))
+
+
+async def close_thread_session(data: dict) -> None:
+    await data["session"].close()
 
 
 async def main():
     load_dotenv()
 
     settings = get_settings()
+    if settings.consumer_mode != "async":
+        # sync consumers run coroutines with run_until_complete inside the running loop
+        nest_asyncio.apply()
 
     configure_logging(settings.loggers)
     connection = await get_db_conn(settings.db_dsn)
     token_service = await get_token_service(settings, connection)
-    driver = get_driver(settings)
+    token_pool = TokenPool(token_service, refresh_interval=settings.token_refresh_interval)
+    await token_pool.load()
+    token_refresher = asyncio.ensure_future(token_pool.run_refresher())
 
-    await auth_browser(driver, token_service)
+    driver_pool = DriverPool(
+        functools.partial(create_driver, settings, token_service, token_pool, asyncio.get_event_loop()),
+        size=max(settings.drivers_count, settings.threads_count),
+        max_uses=settings.driver_max_uses,
+        on_discard=functools.partial(release_driver_token, token_pool),
+    )
+    # drivers are authenticated through this loop, so it must stay free meanwhile
+    await asyncio.get_running_loop().run_in_executor(None, driver_pool.start)
 
-    cookies = convert_browser_cookies_to_aiohttp(driver.get_cookies())
+    async with driver_pool.lease_async() as driver:
+        cookies = convert_browser_cookies_to_aiohttp(driver.get_cookies())
     session = ClientSession(cookies=cookies)
 
+    balance_ledger = BalanceLedger(
+        functools.partial(
+            fetch_robux_balance,
+            session,
+            economy_url=settings.roblox_economy_url,
+            users_url=settings.roblox_users_url,
+        ),
+        resync_interval=settings.balance_resync_interval,
+    )
+    balance_ledger.start()
+    balance_resyncer = asyncio.ensure_future(balance_ledger.run_resyncer())
+
+    metrics = WorkerMetrics()
+    metrics.track_token_pool(token_pool)
+    metrics.track_driver_pool(driver_pool)
+
+    processed = ProcessedTransactions(
+        ProcessedTransactionRepository(connection, settings.processed_table),
+        capacity=settings.processed_cache_size,
+        claim_ttl=settings.processed_claim_ttl,
+    )
+    await processed.load()
+
+    # return signals, the handlers may send them from any consumer thread
+    publisher = AsyncBatchPublisher(
+        settings.queue_dsn,
+        queue=settings.send_queue_name,
+        exchange=settings.send_queue_exchange_name,
+        routing=settings.send_queue_name,
+        batch_size=settings.publisher_batch_size,
+        flush_interval=settings.publisher_flush_interval_ms / 1000,
+        max_in_flight=settings.publisher_max_in_flight,
+        connect_timeout=settings.publisher_connect_timeout_ms / 1000,
+    )
+    await publisher.start()
+
     workflow_data = {
         "settings": settings,
+        "publisher": publisher,
         "connection": connection,
-        "driver": driver,
+        "driver_pool": driver_pool,
         "token_service": token_service,
+        "token_pool": token_pool,
+        "balance_ledger": balance_ledger,
+        "processed": processed,
+        "metrics": metrics,
+        "tracer": get_tracer(settings.trace_sink, settings.trace_buffer_size),
+        "offload_driver": settings.consumer_mode == "async",
         "session": session
     }
+    if settings.purchase_engine == "http":
+        workflow_data["purchase_engine"] = HttpPurchaseEngine(
+            economy_url=settings.roblox_economy_url,
+            auth_url=settings.roblox_auth_url,
+        )
     # ссанина
     kw = {
         "amqp_url": settings.queue_dsn,
         "queue": settings.queue_name,
         "exchange": settings.exchange_name,
         "routing": settings.queue_name,
+        "prefetch_count": settings.prefetch_count,
+        "ack_batch_size": settings.ack_batch_size,
+        "ack_batch_interval": settings.ack_batch_interval_ms / 1000,
+        "retry_max_attempts": settings.retry_max_attempts,
+        "retry_delay_ms": settings.retry_delay_ms,
         "workflow_data": workflow_data
     }
-    root_consumer = URLConsumer(**kw)
-    # root_consumer = MultiThreadedConsumer(**kw)
+    if settings.consumer_mode == "async":
+        kw.update(concurrency=settings.concurrency)
+        root_consumer = AsyncURLConsumer(**kw)
+    elif settings.consumer_mode == "threads":
+        kw.update(
+            threads_count=settings.threads_count,
+            thread_setup=functools.partial(setup_thread_session, cookies),
+            thread_teardown=close_thread_session,
+        )
+        root_consumer = MultiThreadedConsumer(**kw)
+    else:
+        root_consumer = URLConsumer(**kw)
     consumer = ReconnectingURLConsumer(
         consumer=root_consumer,
         **kw,
     )
 
+    metrics.track_consumer(consumer)
+    metrics_server = None
+    if settings.metrics_port:
+        metrics_server = MetricsServer(metrics.registry, settings.metrics_port)
+        metrics_server.start()
+
     root_consumer.add_listener(handlers.DataHandler())
     root_consumer.add_listener(handlers.UrlHandler())
     root_consumer.add_listener(handlers.ReturnSignalHandler())
@@ -62,8 +189,18 @@ async def main():
     logger.info("Starting application")
 
     try:
-        consumer.run()
+        if isinstance(root_consumer, AsyncURLConsumer):
+            await consumer.serve()
+        else:
+            consumer.run()
     except:
-        driver.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        token_refresher.cancel()
+        balance_resyncer.cancel()
+        driver_pool.close()
+        await token_pool.close()
+        await processed.close()
+        await publisher.close()
         await connection.close()
         await session.close()
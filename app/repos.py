@@ -47,6 +47,35 @@ class UserTokenRepository:
 
         return tokens
 
+    async def fetch_active_tokens_after(self, last_id: int = 0, limit: int = 1000) -> Sequence[dict]:
+        """
+        Активные токены с id больше last_id, по порядку id.
+        Используется TokenPool-ом для инкрементального обновления.
+        """
+        sql = f"""
+            SELECT id, token, is_selected 
+            FROM {self._model_name} 
+            WHERE is_active = true AND id > $1 
+            ORDER BY id 
+            LIMIT {limit}
+        """
+
+        return await self.conn.fetchmany(sql, last_id)
+
+    async def fetch_active_among(self, tokens: Sequence[str]) -> Sequence[str]:
+        """
+        Те из переданных токенов, которые все еще активны.
+        Используется TokenPool-ом, чтобы выкинуть деактивированные не им.
+        """
+        sql = f"""
+            SELECT token 
+            FROM {self._model_name} 
+            WHERE is_active = true AND token = ANY($1::text[])
+        """
+
+        results: Sequence[dict] = await self.conn.fetchmany(sql, list(tokens))
+        return [record.get("token") for record in results]
+
     async def is_token_selected(self, token: str) -> bool:
         # если token не селектед то выбирается астивные токены
         conn = self.conn
@@ -115,3 +144,74 @@ class UserTokenRepository:
                            f"roblox_name VARCHAR(255), token TEXT,"
                            f"is_active BOOLEAN DEFAULT true, "
                            f"is_selected BOOLEAN default false);")
+
+
+class ProcessedTransactionRepository:
+    def __init__(self, conn: BasicDBConnector, model_name: str = "processed_transactions") -> None:
+        self.conn = conn
+
+        self._model_name = model_name
+
+    async def fetch(self, tx_id: int) -> Optional[Dict[str, Any]]:
+        # a row without signal is a claim of a transaction which is still processed
+        sql = (f"SELECT tx_id, status_code, signal FROM {self._model_name} "
+               f"WHERE tx_id = $1 AND signal IS NOT NULL LIMIT 1")
+
+        results: Sequence[dict] = await self.conn.fetchmany(sql, tx_id)
+        return results[0] if results else None
+
+    async def fetch_recent(self, limit: int = 1000) -> Sequence[dict]:
+        """
+        Последние обработанные транзакции, сначала новые.
+        """
+        sql = f"""
+            SELECT tx_id, status_code, signal 
+            FROM {self._model_name} 
+            WHERE signal IS NOT NULL
+            ORDER BY processed_at DESC 
+            LIMIT {limit}
+        """
+
+        return await self.conn.fetchmany(sql)
+
+    async def claim(self, tx_id: int, ttl: int) -> bool:
+        """
+        Атомарно забирает транзакцию в обработку. False если она уже
+        обработана, или ее обрабатывает другая доставка и ее claim
+        моложе `ttl` секунд (старый claim остается от упавшего воркера).
+        """
+        results: Sequence[dict] = await self.conn.fetchmany(
+            f"INSERT INTO {self._model_name} AS t (tx_id) VALUES ($1) "
+            f"ON CONFLICT (tx_id) DO UPDATE SET processed_at = now() "
+            f"WHERE t.signal IS NULL AND t.processed_at < now() - $2::int * interval '1 second' "
+            f"RETURNING tx_id",
+            tx_id, ttl,
+        )
+        return bool(results)
+
+    async def release(self, tx_id: int) -> None:
+        await self.conn.execute(
+            f"DELETE FROM {self._model_name} WHERE tx_id = $1 AND signal IS NULL",
+            tx_id,
+        )
+
+    async def save(self, tx_id: int, status_code: int, signal: str) -> None:
+        # fills the claim, the first result wins, a redelivered message must not overwrite it
+        await self.conn.execute(
+            f"INSERT INTO {self._model_name} AS t (tx_id, status_code, signal) VALUES ($1, $2, $3) "
+            f"ON CONFLICT (tx_id) DO UPDATE SET status_code = EXCLUDED.status_code, "
+            f"signal = EXCLUDED.signal, processed_at = now() "
+            f"WHERE t.signal IS NULL",
+            tx_id, status_code, signal,
+        )
+
+    async def create_table(self) -> None:
+        await self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self._model_name} ("
+                                f"tx_id BIGINT PRIMARY KEY, "
+                                f"status_code INTEGER, "
+                                f"signal TEXT, "
+                                f"processed_at TIMESTAMP DEFAULT now());")
+        # tables created before claims had both columns NOT NULL
+        await self.conn.execute(f"ALTER TABLE {self._model_name} "
+                                f"ALTER COLUMN status_code DROP NOT NULL, "
+                                f"ALTER COLUMN signal DROP NOT NULL;")
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from aiohttp import ClientSession
+from loguru import logger
+
+from app.consts import ROBLOX_TOKEN_KEY, ROBLOX_ECONOMY_URL, ROBLOX_USERS_URL
+
+DEFAULT_RESYNC_INTERVAL = 300
+
+
+async def fetch_robux_balance(
+        session: ClientSession,
+        token: str,
+        economy_url: str = ROBLOX_ECONOMY_URL,
+        users_url: str = ROBLOX_USERS_URL,
+) -> int:
+    cookies = {ROBLOX_TOKEN_KEY: token}
+
+    async with session.get(f"{users_url}/v1/users/authenticated", cookies=cookies) as resp:
+        if resp.status != 200:
+            raise ValueError(f"Token is not authenticated, status {resp.status}")
+        user_id = (await resp.json())["id"]
+
+    async with session.get(f"{economy_url}/v1/users/{user_id}/currency", cookies=cookies) as resp:
+        if resp.status != 200:
+            raise ValueError(f"Currency responded with {resp.status}")
+        return (await resp.json())["robux"]
+
+
+class BalanceLedger:
+    """
+    Баланс робуксов каждого токена в памяти.
+
+    Баланс заполняется один раз (`seed`), уменьшается локально после
+    каждой успешной покупки (`debit`) и сверяется с economy api в фоне,
+    либо сразу при несовпадении (`invalidate`). Так что решение о смене
+    токена принимается без ожидания страницы.
+
+    Списания, сделанные пока идет запрос в api, вычитаются из его
+    ответа: api мог их еще не увидеть, а лишний вычет безопаснее
+    перерасхода.
+    """
+
+    def __init__(
+            self,
+            fetcher: Callable[[str], Awaitable[int]],
+            resync_interval: float = DEFAULT_RESYNC_INTERVAL,
+    ) -> None:
+        self._fetcher = fetcher
+        self._resync_interval = resync_interval
+
+        self._balances: Dict[str, int] = {}
+        # all debits of a token, only differences between two readings matter
+        self._debited: Dict[str, int] = {}
+        self._resyncing: Set[str] = set()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    def get(self, token: str) -> Optional[int]:
+        return self._balances.get(token)
+
+    def seed(self, token: str, amount: int) -> None:
+        with self._lock:
+            self._balances[token] = amount
+
+    def debit(self, token: str, amount: int) -> Optional[int]:
+        with self._lock:
+            self._debited[token] = self._debited.get(token, 0) + amount
+            if token not in self._balances:
+                return None
+            self._balances[token] -= amount
+            return self._balances[token]
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._balances.pop(token, None)
+        self.schedule_resync(token)
+
+    def schedule_resync(self, token: str) -> None:
+        if self._loop is None:
+            raise RuntimeError("BalanceLedger.start() was not called")
+
+        with self._lock:
+            if token in self._resyncing:
+                return
+            self._resyncing.add(token)
+        asyncio.run_coroutine_threadsafe(self.resync(token), self._loop).add_done_callback(self._on_resynced)
+
+    @staticmethod
+    def _on_resynced(future: Future) -> None:
+        if future.exception():
+            logger.warning(f"Balance resync failed: {future.exception()}")
+
+    async def resync(self, token: str) -> int:
+        debited = self._debited.get(token, 0)
+        try:
+            amount = await self._fetcher(token)
+        finally:
+            with self._lock:
+                self._resyncing.discard(token)
+
+        with self._lock:
+            amount -= self._debited.get(token, 0) - debited
+            previous = self._balances.get(token)
+            self._balances[token] = amount
+        if previous is not None and previous != amount:
+            logger.info(f"Balance drifted from {previous} to {amount}")
+        return amount
+
+    async def run_resyncer(self) -> None:
+        while True:
+            await asyncio.sleep(self._resync_interval)
+            for token in list(self._balances):
+                try:
+                    await self.resync(token)
+                except Exception as e:
+                    logger.warning(f"Balance resync failed: {e}")
@@ -0,0 +1,230 @@
+import asyncio
+import contextlib
+import functools
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+from loguru import logger
+from selenium.common import WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+
+
+DEFAULT_POOL_SIZE = 1
+DEFAULT_MAX_USES = 50
+DEFAULT_ACQUIRE_TIMEOUT = 60
+
+
+class DriverPoolClosed(Exception):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("event", "driver")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.driver: Optional[WebDriver] = None
+
+
+class DriverPool:
+    """
+    Пул заранее авторизованных браузеров.
+
+    Каждое сообщение берет себе драйвер через `lease()` и возвращает его
+    обратно после обработки. Драйвер пересоздается после `max_uses`
+    использований, если он упал во время обработки, или если не прошел
+    проверку здоровья при выдаче.
+
+    `factory` должна возвращать уже авторизованный драйвер, `on_discard`
+    вызывается перед закрытием драйвера (например что бы вернуть его токен).
+    Если `factory` упала при пересоздании, в пуле остается пустое место (None),
+    драйвер для него создается при следующей выдаче, так что размер пула
+    не уменьшается. Пул потокобезопасен и может использоваться
+    из MultiThreadedConsumer.
+    Освободившийся драйвер отдается самому давнему ожидающему,
+    так что потоки обслуживаются по очереди.
+    """
+
+    def __init__(
+            self,
+            factory: Callable[[], WebDriver],
+            size: int = DEFAULT_POOL_SIZE,
+            max_uses: int = DEFAULT_MAX_USES,
+            acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT,
+            on_discard: Optional[Callable[[WebDriver], None]] = None,
+    ) -> None:
+        if size < 1:
+            raise ValueError("Pool size must be positive")
+
+        self._factory = factory
+        self._size = size
+        self._max_uses = max_uses
+        self._acquire_timeout = acquire_timeout
+        self._on_discard = on_discard
+
+        # None is a slot whose driver failed to start
+        self._idle: Deque[Optional[WebDriver]] = deque()
+        self._waiters: Deque[_Waiter] = deque()
+        self._uses: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.checkouts = 0
+        self.recycles = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def start(self) -> None:
+        logger.info(f"Starting driver pool with {self._size} drivers")
+
+        for _ in range(self._size):
+            self._put(self._create())
+
+    def _create(self) -> WebDriver:
+        driver = self._factory()
+        with self._lock:
+            self._uses[id(driver)] = 0
+        return driver
+
+    def _discard(self, driver: WebDriver) -> None:
+        with self._lock:
+            self._uses.pop(id(driver), None)
+        if self._on_discard is not None:
+            try:
+                self._on_discard(driver)
+            except Exception as e:
+                logger.warning(f"on_discard failed for driver: {e}")
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Failed to quit driver: {e}")
+
+    def _recycle(self, driver: WebDriver) -> Optional[WebDriver]:
+        logger.info("Recycling driver")
+
+        self.recycles += 1
+        self._discard(driver)
+        try:
+            return self._create()
+        except Exception:
+            logger.exception("Failed to create driver, retrying on the next checkout")
+            return None
+
+    @staticmethod
+    def is_healthy(driver: WebDriver) -> bool:
+        try:
+            # any round trip to the browser process is enough
+            driver.current_url
+        except WebDriverException:
+            return False
+        return True
+
+    def acquire(self, timeout: Optional[float] = None) -> WebDriver:
+        if self._closed:
+            raise DriverPoolClosed
+
+        if timeout is None:
+            timeout = self._acquire_timeout
+        driver = self._get(timeout)
+
+        if driver is not None and not self.is_healthy(driver):
+            logger.warning("Driver is not healthy, replacing it")
+            self.recycles += 1
+            self._discard(driver)
+            driver = None
+
+        if driver is None:
+            try:
+                driver = self._create()
+            except BaseException:
+                # the slot goes back empty, so the pool keeps its size
+                self._put(None)
+                raise
+
+        with self._lock:
+            self._uses[id(driver)] += 1
+            self.checkouts += 1
+        return driver
+
+    def _get(self, timeout: float) -> Optional[WebDriver]:
+        with self._lock:
+            if self._idle:
+                return self._idle.popleft()
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+
+        if not waiter.event.wait(timeout):
+            with self._lock:
+                if not waiter.event.is_set():
+                    self._waiters.remove(waiter)
+                    raise TimeoutError("No free driver in the pool")
+        return waiter.driver
+
+    def _put(self, driver: Optional[WebDriver]) -> None:
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.driver = driver
+                waiter.event.set()
+            else:
+                self._idle.append(driver)
+
+    def release(self, driver: WebDriver, failed: bool = False) -> None:
+        if self._closed:
+            self._discard(driver)
+            return
+
+        with self._lock:
+            uses = self._uses.get(id(driver), 0)
+
+        if failed or uses >= self._max_uses:
+            driver = self._recycle(driver)
+        self._put(driver)
+
+    @contextlib.contextmanager
+    def lease(self, timeout: Optional[float] = None) -> Iterator[WebDriver]:
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        except BaseException:
+            self.release(driver, failed=True)
+            raise
+        else:
+            self.release(driver)
+
+    @contextlib.asynccontextmanager
+    async def lease_async(self, timeout: Optional[float] = None) -> AsyncIterator[WebDriver]:
+        # waiting and recycling are blocking, so they go to the executor
+        loop = asyncio.get_running_loop()
+        driver = await loop.run_in_executor(None, self.acquire, timeout)
+        try:
+            yield driver
+        except BaseException:
+            await loop.run_in_executor(None, functools.partial(self.release, driver, failed=True))
+            raise
+        else:
+            await loop.run_in_executor(None, self.release, driver)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "waiting": len(self._waiters),
+            "checkouts": self.checkouts,
+            "recycles": self.recycles,
+        }
+
+    def close(self) -> None:
+        self._closed = True
+
+        with self._lock:
+            drivers = list(self._idle)
+            self._idle.clear()
+
+        drivers = [driver for driver in drivers if driver is not None]
+        logger.info(f"Closing {len(drivers)} idle drivers")
+        for driver in drivers:
+            self._discard(driver)
@@ -1,7 +1,9 @@
 import asyncio
 import inspect
 import threading
+import time
 from platform import uname
+from typing import Callable, Optional, Tuple
 from urllib.parse import urlparse
 
 from loguru import logger
@@ -15,37 +17,112 @@ def _get_spec(func: callable):
     return inspect.getfullargspec(func)
 
 
-def _check_spec(spec: inspect.FullArgSpec, kwargs: dict):
-    if spec.varkw:
-        return kwargs
+LISTENER_METHODS = ("__call__", "setup", "close")
 
-    return {k: v for k, v in kwargs.items() if k in set(spec.args + spec.kwonlyargs)}
 
+class ListenerPlan:
+    """
+    Precompiled dispatch info of one listener method,
+    so per message we only project workflow data to accepted keys.
 
-def run_listeners(data, listeners, key: str = '__call__'):
+    """
+    __slots__ = ("func", "keys", "is_async", "name")
+
+    def __init__(self, func: callable, keys: Optional[Tuple[str, ...]], is_async: bool, name: str = "") -> None:
+        self.func = func
+        # None means the listener accepts **kwargs and receives everything
+        self.keys = keys
+        self.is_async = is_async
+        self.name = name or getattr(func, "__qualname__", repr(func))
+
+    def project(self, data: dict) -> dict:
+        if self.keys is None:
+            return data
+        return {k: data[k] for k in self.keys if k in data}
+
+
+def compile_listener(listener, key: str = '__call__') -> ListenerPlan:
+    func = getattr(listener, key)
+    spec = _get_spec(func)
+    keys = None if spec.varkw else tuple(dict.fromkeys(spec.args + spec.kwonlyargs))
+    return ListenerPlan(func, keys, asyncio.iscoroutinefunction(func), type(listener).__name__)
+
+
+def _as_plan(listener, key: str) -> ListenerPlan:
+    if isinstance(listener, ListenerPlan):
+        return listener
+    return compile_listener(listener, key)
+
+
+def run_listeners(data, listeners, key: str = '__call__', observe: Optional[Callable[[str, float], None]] = None):
+    """
+    :param listeners: ListenerPlan-ы, либо сами слушатели,
+        которые тогда компилируются на каждый вызов
+    :param observe: вызывается с именем слушателя и временем его работы
+    """
     for listener in listeners:
+        plan = _as_plan(listener, key)
+        started = time.perf_counter()
         try:
-            func = getattr(listener, key)
-            spec = _get_spec(func)
-            workflow = _check_spec(spec, data)
-            if asyncio.iscoroutinefunction(func):
+            workflow = plan.project(data)
+            if plan.is_async:
                 loop = asyncio.get_event_loop()
 
                 if threading.current_thread().name != "MainThread":
                     logger.debug("Executing in thread")
-                    task = func(**workflow)
+                    task = plan.func(**workflow)
                     loop.run_until_complete(task)
 
                     logger.debug("Task in thread has been completed")
                 else:
-                    loop.run_until_complete(func(**workflow))
+                    loop.run_until_complete(plan.func(**workflow))
+            else:
+                plan.func(**workflow)
+
+        except SkipException:
+            pass
+        except CancelException:
+            break
+        finally:
+            if observe is not None:
+                observe(plan.name, time.perf_counter() - started)
+
+
+async def run_listeners_async(
+        data, listeners, key: str = '__call__', observe: Optional[Callable[[str, float], None]] = None):
+    """
+    Same as run_listeners but for code which is already running in the loop,
+    coroutine listeners are awaited directly instead of run_until_complete.
+
+    """
+    for listener in listeners:
+        plan = _as_plan(listener, key)
+        started = time.perf_counter()
+        try:
+            workflow = plan.project(data)
+            if plan.is_async:
+                await plan.func(**workflow)
             else:
-                func(**workflow)
+                plan.func(**workflow)
 
         except SkipException:
             pass
         except CancelException:
             break
+        finally:
+            if observe is not None:
+                observe(plan.name, time.perf_counter() - started)
+
+
+def run_sync(coro, loop: asyncio.AbstractEventLoop):
+    """
+    Runs coroutine on the given loop from any thread and waits for the result.
+    From the loop's own thread it relies on nest_asyncio re-entrancy.
+
+    """
+    if threading.current_thread() is threading.main_thread():
+        return loop.run_until_complete(coro)
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
 
 
 def in_wsl() -> bool:
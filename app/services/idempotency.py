@@ -0,0 +1,163 @@
+import asyncio
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Set
+
+from loguru import logger
+
+from app.repos import ProcessedTransactionRepository
+from app.schemas import ReturnSignal, StatusCodes
+
+DEFAULT_PROCESSED_CACHE_SIZE = 10000
+DEFAULT_CLAIM_TTL = 600
+
+# statuses which will not change if the message is processed again,
+# no_tokens_available and fail may succeed on the next delivery
+FINAL_STATUSES = frozenset({
+    StatusCodes.success,
+    StatusCodes.already_bought,
+    StatusCodes.invalid_data,
+    StatusCodes.invalid_price,
+})
+
+
+class TransactionInProgress(Exception):
+    """
+    Транзакцию сейчас обрабатывает другая доставка того же сообщения.
+    """
+
+
+class ProcessedTransactions:
+    """
+    Уже обработанные транзакции, по tx_id.
+
+    Последние `capacity` ответов лежат в LRU в памяти, так что повторно
+    доставленное сообщение (после реконнекта или потерянного ack)
+    получает свой ReturnSignal без браузера и без запроса в бд.
+    Остальные ищутся в бд, запись в бд идет в фоне на loop-е
+    в котором был вызван `load()`, как в TokenPool.
+
+    Перед покупкой транзакция забирается через `claim`: сначала в
+    множестве in-flight этого процесса, потом строкой без ответа в бд
+    (INSERT ... ON CONFLICT DO NOTHING), так что две одновременные
+    доставки одного tx_id не покупают дважды. `save` заполняет claim
+    ответом, `release` снимает его, если покупка упала. Claim старше
+    `claim_ttl` секунд считается брошенным упавшим воркером.
+
+    Все методы можно вызывать с loop-а любого треда.
+    """
+
+    def __init__(
+            self,
+            repo: ProcessedTransactionRepository,
+            capacity: int = DEFAULT_PROCESSED_CACHE_SIZE,
+            claim_ttl: int = DEFAULT_CLAIM_TTL,
+    ) -> None:
+        self._repo = repo
+        self._capacity = capacity
+        self._claim_ttl = claim_ttl
+
+        self._recent: OrderedDict[int, ReturnSignal] = OrderedDict()
+        self._in_flight: Set[int] = set()
+        self._lock = threading.Lock()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writes: Set[Future] = set()
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    async def load(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        await self._repo.create_table()
+
+        records = await self._repo.fetch_recent(self._capacity)
+        # newest first, so the oldest end up at the front of the LRU
+        for record in reversed(records):
+            self._remember(record["tx_id"], ReturnSignal.parse_raw(record["signal"]))
+
+        logger.info(f"Loaded {len(self)} processed transactions")
+
+    def _remember(self, tx_id: int, signal: ReturnSignal) -> None:
+        with self._lock:
+            self._recent[tx_id] = signal
+            self._recent.move_to_end(tx_id)
+            while len(self._recent) > self._capacity:
+                self._recent.popitem(last=False)
+
+    async def get(self, tx_id: int) -> Optional[ReturnSignal]:
+        with self._lock:
+            signal = self._recent.get(tx_id)
+            if signal is not None:
+                self._recent.move_to_end(tx_id)
+                return signal
+
+        record = await self._run(self._repo.fetch(tx_id))
+        if record is None:
+            return None
+
+        signal = ReturnSignal.parse_raw(record["signal"])
+        self._remember(tx_id, signal)
+        return signal
+
+    async def _run(self, coro):
+        if self._loop is None:
+            coro.close()
+            raise RuntimeError("ProcessedTransactions.load() was not called")
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        # the db pool belongs to the main loop
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    async def claim(self, tx_id: int) -> bool:
+        with self._lock:
+            if tx_id in self._in_flight:
+                return False
+            self._in_flight.add(tx_id)
+
+        try:
+            claimed = await self._run(self._repo.claim(tx_id, self._claim_ttl))
+        except BaseException:
+            self._forget_claim(tx_id)
+            raise
+        if not claimed:
+            self._forget_claim(tx_id)
+        return claimed
+
+    def _forget_claim(self, tx_id: int) -> None:
+        with self._lock:
+            self._in_flight.discard(tx_id)
+
+    async def release(self, tx_id: int) -> None:
+        try:
+            await self._run(self._repo.release(tx_id))
+        finally:
+            self._forget_claim(tx_id)
+
+    def save(self, tx_id: int, signal: ReturnSignal) -> None:
+        if self._loop is None:
+            raise RuntimeError("ProcessedTransactions.load() was not called")
+
+        if signal.status_code in FINAL_STATUSES:
+            self._remember(tx_id, signal)
+            write = self._repo.save(tx_id, int(signal.status_code), signal.json())
+        else:
+            # the next delivery may succeed, so the claim is dropped instead
+            write = self._repo.release(tx_id)
+
+        future = asyncio.run_coroutine_threadsafe(write, self._loop)
+        self._writes.add(future)
+        future.add_done_callback(functools.partial(self._on_written, tx_id))
+
+    def _on_written(self, tx_id: int, future: Future) -> None:
+        self._writes.discard(future)
+        # the answer is in the LRU already, a redelivery until now is answered from there
+        self._forget_claim(tx_id)
+        if future.exception():
+            logger.error(f"Failed to save processed transaction: {future.exception()}")
+
+    async def close(self) -> None:
+        if self._writes:
+            await asyncio.gather(*(asyncio.wrap_future(x) for x in list(self._writes)), return_exceptions=True)
@@ -0,0 +1,118 @@
+"""
+Метрики воркера в формате Prometheus, через prometheus_client.
+
+Все метрики лежат в своем CollectorRegistry, а `MetricsServer` отдает
+их на /metrics из отдельного треда, не трогая ioloop консьюмера.
+"""
+from typing import Iterator, Optional
+
+from loguru import logger
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily, Metric
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _DriverPoolCollector:
+    """
+    Пересоздания браузеров считает сам пул, здесь они только читаются.
+    """
+
+    def __init__(self, driver_pool) -> None:
+        self._driver_pool = driver_pool
+
+    def collect(self) -> Iterator[Metric]:
+        yield CounterMetricFamily(
+            "worker_browser_recycles", "Browsers restarted after max uses or a failed health check",
+            value=self._driver_pool.recycles)
+
+
+class WorkerMetrics:
+    """
+    Метрики воркера покупок.
+
+    Лежит в workflow_data под ключом `metrics`, хендлеры и
+    process_message обновляют ее сами, а размеры пулов и очереди
+    читаются функциями в момент запроса.
+    """
+
+    def __init__(self, registry: Optional[CollectorRegistry] = None) -> None:
+        self.registry = registry or CollectorRegistry()
+
+        self.messages = Counter(
+            "worker_messages", "Messages taken from the queue", registry=self.registry)
+        self.message_seconds = Histogram(
+            "worker_message_seconds", "Time to process one message with all listeners",
+            buckets=DEFAULT_BUCKETS, registry=self.registry)
+        self.stage_seconds = Histogram(
+            "worker_stage_seconds", "Time spent in each listener", ["stage"],
+            buckets=DEFAULT_BUCKETS, registry=self.registry)
+        self.statuses = Counter(
+            "worker_return_signals", "Return signals sent, by status", ["status"], registry=self.registry)
+        self.duplicates = Counter(
+            "worker_duplicate_transactions", "Redelivered transactions answered from the processed store",
+            registry=self.registry)
+        self.token_rotations = Counter(
+            "worker_token_rotations", "Tokens replaced because of low balance or failed auth",
+            registry=self.registry)
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        self.stage_seconds.labels(stage=stage).observe(seconds)
+
+    def observe_message(self, seconds: float) -> None:
+        self.messages.inc()
+        self.message_seconds.observe(seconds)
+
+    def count_status(self, status) -> None:
+        self.statuses.labels(status=getattr(status, "name", str(status))).inc()
+
+    def track_consumer(self, consumer) -> None:
+        """
+        :param consumer: ReconnectingURLConsumer, а не сам консьюмер,
+            он пересоздается при переподключении
+        """
+        Gauge(
+            "worker_in_flight_messages", "Delivered messages which are not acked yet",
+            registry=self.registry).set_function(lambda: consumer.in_flight)
+        Gauge(
+            "worker_prefetch_count", "Prefetch count of the consumer channel",
+            registry=self.registry).set_function(lambda: consumer.prefetch_count)
+
+    def track_token_pool(self, token_pool) -> None:
+        Gauge(
+            "worker_tokens", "Active tokens in the pool",
+            registry=self.registry).set_function(lambda: len(token_pool))
+        Gauge(
+            "worker_free_tokens", "Tokens which are not leased",
+            registry=self.registry).set_function(lambda: token_pool.free)
+
+    def track_driver_pool(self, driver_pool) -> None:
+        Gauge(
+            "worker_drivers", "Browsers in the pool",
+            registry=self.registry).set_function(lambda: driver_pool.size)
+        self.registry.register(_DriverPoolCollector(driver_pool))
+
+
+class MetricsServer:
+    """
+    /metrics из start_http_server prometheus_client, в треде-демоне.
+    """
+
+    def __init__(self, registry: CollectorRegistry, port: int, host: str = "0.0.0.0") -> None:
+        self._registry = registry
+        self._port = port
+        self._host = host
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1] if self._server is not None else self._port
+
+    def start(self) -> None:
+        self._server, _ = start_http_server(self._port, addr=self._host, registry=self._registry)
+        logger.info(f"Metrics are served on :{self.port}/metrics")
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,112 @@
+from typing import Any, Dict
+
+from aiohttp import ClientSession
+from loguru import logger
+
+from app.consts import ROBLOX_ECONOMY_URL, ROBLOX_AUTH_URL, ROBLOX_TOKEN_KEY
+from app.schemas import PurchaseData, ReturnSignal, StatusCodes
+from app.services.validators import extract_game_pass_id
+
+CSRF_HEADER = "x-csrf-token"
+ROBUX_CURRENCY = 1
+
+
+class PurchaseEngineError(Exception):
+    pass
+
+
+class InsufficientFundsError(PurchaseEngineError):
+    pass
+
+
+class HttpPurchaseEngine:
+    """
+    Покупает геймпасс через economy api роблокса без браузера.
+
+    Сессия передается в каждый вызов, потому что у каждого треда
+    своя aiohttp сессия (см. MultiThreadedConsumer), а токен аккаунта -
+    потому что покупает тот аккаунт, который сейчас у браузера
+    сообщения. Если покупка не может быть завершена здесь,
+    то бросается PurchaseEngineError, и UrlHandler продолжает через браузер.
+    """
+
+    def __init__(self, economy_url: str = ROBLOX_ECONOMY_URL, auth_url: str = ROBLOX_AUTH_URL) -> None:
+        self.economy_url = economy_url.rstrip("/")
+        self.auth_url = auth_url.rstrip("/")
+
+        # csrf токен роблокса привязан к аккаунту
+        self._csrf_tokens: Dict[str, str] = {}
+
+    @staticmethod
+    def _cookies(token: str) -> Dict[str, str]:
+        return {ROBLOX_TOKEN_KEY: token}
+
+    async def fetch_product_info(self, session: ClientSession, game_pass_id: int, token: str) -> Dict[str, Any]:
+        url = f"{self.economy_url}/v1/game-pass/{game_pass_id}/game-pass-product-info"
+
+        async with session.get(url, cookies=self._cookies(token)) as resp:
+            if resp.status != 200:
+                raise PurchaseEngineError(f"Product info responded with {resp.status}")
+            return await resp.json()
+
+    async def fetch_csrf_token(self, session: ClientSession, token: str) -> str:
+        # roblox answers 403 with a fresh token on any unsigned POST
+        async with session.post(f"{self.auth_url}/v2/logout", cookies=self._cookies(token)) as resp:
+            csrf = resp.headers.get(CSRF_HEADER)
+        if not csrf:
+            raise PurchaseEngineError("Roblox did not give csrf token")
+
+        self._csrf_tokens[token] = csrf
+        return csrf
+
+    async def _post_purchase(self, session: ClientSession, product_id: int, body: dict, token: str) -> Dict[str, Any]:
+        url = f"{self.economy_url}/v1/purchases/products/{product_id}"
+        csrf = self._csrf_tokens.get(token) or await self.fetch_csrf_token(session, token)
+
+        for _ in range(2):
+            async with session.post(
+                    url, json=body, headers={CSRF_HEADER: csrf}, cookies=self._cookies(token)) as resp:
+                if resp.status == 403 and resp.headers.get(CSRF_HEADER):
+                    # token expired, the response carries a new one
+                    csrf = self._csrf_tokens[token] = resp.headers[CSRF_HEADER]
+                    continue
+                if resp.status != 200:
+                    raise PurchaseEngineError(f"Purchase responded with {resp.status}")
+                return await resp.json()
+
+        raise PurchaseEngineError("Csrf token was rejected twice")
+
+    async def purchase(self, session: ClientSession, purchase_data: PurchaseData, token: str) -> ReturnSignal:
+        """
+        :param token: .ROBLOSECURITY аккаунта, который платит
+        """
+        game_pass_id = extract_game_pass_id(purchase_data.url)
+        if game_pass_id is None:
+            return ReturnSignal(status_code=StatusCodes.invalid_data)
+
+        info = await self.fetch_product_info(session, game_pass_id, token)
+        price = info.get("PriceInRobux")
+        logger.info(f"Cost of gamepass from api: {price}")
+
+        if price != purchase_data.price:
+            logger.info("Price is not equal to url's price")
+            return ReturnSignal(status_code=StatusCodes.invalid_price)
+
+        result = await self._post_purchase(session, info["ProductId"], {
+            "expectedCurrency": ROBUX_CURRENCY,
+            "expectedPrice": price,
+            "expectedSellerId": info["Creator"]["Id"],
+        }, token)
+
+        reason = result.get("reason")
+        if result.get("purchased"):
+            logger.info(f"Purchased gamepass for {price} robuxes through api")
+            return ReturnSignal(status_code=StatusCodes.success)
+        if reason == "AlreadyOwned":
+            logger.info("Gamepass has been already bought")
+            return ReturnSignal(status_code=StatusCodes.already_bought)
+
+        # the browser path rotates the token
+        if reason == "InsufficientFunds":
+            raise InsufficientFundsError(f"Purchase was not completed: {reason}")
+        raise PurchaseEngineError(f"Purchase was not completed: {reason}")
@@ -0,0 +1,102 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from loguru import logger
+
+DEFAULT_ACK_BATCH_SIZE = 1
+DEFAULT_ACK_BATCH_INTERVAL = 0.05
+
+
+class AckBatcher:
+    """
+    Отправляет ack-и одного канала пачками через `multiple=True`.
+
+    Сообщения могут завершаться не по порядку (треды, async), а
+    `multiple=True` подтверждает все теги до указанного, поэтому ack
+    отправляется только до "водораздела": до него все полученные
+    сообщения уже завершены. Nack отправляется сразу и только на одно
+    сообщение.
+
+    Пачка уходит когда набралось `batch_size` ack-ов или прошло
+    `interval` секунд с первого неотправленного. С batch_size=1
+    каждый ack отправляется сразу, как раньше.
+
+    Работает только в потоке ioloop-а, на каждый новый канал нужен
+    новый AckBatcher, теги в канале начинаются заново.
+    """
+
+    def __init__(
+            self,
+            channel,
+            loop: asyncio.AbstractEventLoop,
+            batch_size: int = DEFAULT_ACK_BATCH_SIZE,
+            interval: float = DEFAULT_ACK_BATCH_INTERVAL,
+    ) -> None:
+        self._channel = channel
+        self._loop = loop
+        self._batch_size = max(batch_size, 1)
+        self._interval = interval
+
+        self._delivered: Deque[int] = deque()
+        self._done: Dict[int, bool] = {}
+        self._ack_tag = 0
+        self._unsent = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.in_flight = 0
+
+    @property
+    def batching(self) -> bool:
+        return self._batch_size > 1
+
+    def delivered(self, delivery_tag: int) -> None:
+        self.in_flight += 1
+        if self.batching:
+            self._delivered.append(delivery_tag)
+
+    def ack(self, delivery_tag: int) -> None:
+        self.in_flight -= 1
+        if not self.batching:
+            self._channel.basic_ack(delivery_tag)
+            return
+        self._complete(delivery_tag, acked=True)
+
+    def nack(self, delivery_tag: int, requeue: bool = True) -> None:
+        self.in_flight -= 1
+        self._channel.basic_nack(delivery_tag, multiple=False, requeue=requeue)
+        if self.batching:
+            self._complete(delivery_tag, acked=False)
+
+    def _complete(self, delivery_tag: int, acked: bool) -> None:
+        self._done[delivery_tag] = acked
+
+        while self._delivered and self._delivered[0] in self._done:
+            tag = self._delivered.popleft()
+            if self._done.pop(tag):
+                # nacked tags are already settled, a multiple ack must not name them
+                self._ack_tag = tag
+                self._unsent += 1
+
+        if self._unsent >= self._batch_size:
+            self.flush()
+        elif self._unsent and self._timer is None:
+            self._timer = self._loop.call_later(self._interval, self.flush)
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._unsent:
+            return
+        if not self._channel.is_open:
+            logger.warning(f"Channel closed, {self._unsent} messages will be redelivered")
+            self._unsent = 0
+            return
+
+        self._channel.basic_ack(self._ack_tag, multiple=True)
+        self._unsent = 0
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -4,8 +4,8 @@ import contextvars
 import functools
 import threading
 import time
-from multiprocessing.pool import ThreadPool, CLOSE
-from typing import Union, List, Callable, Any
+from multiprocessing.pool import ThreadPool, CLOSE, AsyncResult
+from typing import Union, List, Callable, Any, Optional, Set, Dict
 
 import pika
 from pika.adapters.asyncio_connection import AsyncioConnection
@@ -14,10 +14,64 @@ from pika.exchange_type import ExchangeType
 from loguru import logger
 
 from app.services.interfaces import ListenerType, BasicConsumer
-from app.services.helpers import run_listeners
+from app.services.queue.acks import AckBatcher, DEFAULT_ACK_BATCH_SIZE, DEFAULT_ACK_BATCH_INTERVAL
+from app.services.helpers import run_listeners, run_listeners_async, ListenerPlan, compile_listener, \
+    LISTENER_METHODS
 
 
 DEFAULT_THREADS_COUNT = 1
+PREFETCH_PER_THREAD = 2
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RETRY_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY_MS = 5000
+ATTEMPTS_HEADER = "x-attempts"
+
+
+def process_message(data: dict, listeners: List[ListenerPlan]) -> None:
+    """
+    Runs listeners for one message, if there is a `driver_pool`
+    in workflow data then a driver is leased from it for this message only.
+    With `metrics` in workflow data every listener is timed.
+
+    """
+    metrics = data.get("metrics")
+    observe = metrics.observe_stage if metrics is not None else None
+    started = time.perf_counter()
+
+    pool = data.get("driver_pool")
+    try:
+        if pool is None:
+            run_listeners(data, listeners, observe=observe)
+            return
+
+        with pool.lease() as driver:
+            data.update(driver=driver)
+            try:
+                run_listeners(data, listeners, observe=observe)
+            finally:
+                data.pop("driver", None)
+    finally:
+        if metrics is not None:
+            metrics.observe_message(time.perf_counter() - started)
+
+
+async def process_message_async(data: dict, listeners: List[ListenerPlan]) -> None:
+    metrics = data.get("metrics")
+    observe = metrics.observe_stage if metrics is not None else None
+    started = time.perf_counter()
+
+    pool = data.get("driver_pool")
+    try:
+        if pool is None:
+            await run_listeners_async(data, listeners, observe=observe)
+            return
+
+        async with pool.lease_async() as driver:
+            data.update(driver=driver)
+            await run_listeners_async(data, listeners, observe=observe)
+    finally:
+        if metrics is not None:
+            metrics.observe_message(time.perf_counter() - started)
 
 
 # COPY PASTE FROM https://github.com/pika/pika/blob/main/examples/asyncio_consumer_example.py
@@ -39,11 +93,32 @@ class ExampleConsumer(BasicConsumer):
     # QUEUE = 'text'
     # ROUTING_KEY = 'example.text'
 
-    def __init__(self, amqp_url, exchange: str, queue: str, routing: str):
+    def __init__(
+            self,
+            amqp_url,
+            exchange: str,
+            queue: str,
+            routing: str,
+            prefetch_count: int = 0,
+            ack_batch_size: int = DEFAULT_ACK_BATCH_SIZE,
+            ack_batch_interval: float = DEFAULT_ACK_BATCH_INTERVAL,
+            retry_max_attempts: int = DEFAULT_RETRY_MAX_ATTEMPTS,
+            retry_delay_ms: int = DEFAULT_RETRY_DELAY_MS,
+    ):
         """Create a new instance of the consumer class, passing in the AMQP
         URL used to connect to RabbitMQ.
 
         :param str amqp_url: The AMQP url to connect with
+        :param int prefetch_count: 0 derives it from the consumer concurrency
+        :param int ack_batch_size: acks are sent with multiple=True
+            every ack_batch_size messages, 1 acks every message at once
+        :param float ack_batch_interval: seconds before an incomplete
+            ack batch is sent anyway
+        :param int retry_max_attempts: failed messages are retried through
+            the retry queue until they failed this many times, then they go
+            to the dead queue. 0 sends them to the dead queue right away
+        :param int retry_delay_ms: how long a failed message waits in the
+            retry queue
 
         """
         self.ROUTING_KEY = routing
@@ -59,9 +134,39 @@ class ExampleConsumer(BasicConsumer):
         self._consumer_tag = None
         self._url = amqp_url
         self._consuming = False
-        # In production, experiment with higher prefetch values
-        # for higher consumer throughput
-        self._prefetch_count = 1
+        self._prefetch_setting = prefetch_count
+        self._ack_batch_size = ack_batch_size
+        self._ack_batch_interval = ack_batch_interval
+        self._acks: Optional[AckBatcher] = None
+        self._prefetch_count = self.derive_prefetch(1)
+        # publisher confirm tag of a republished failed message -> its delivery tag
+        self._republished: Dict[int, int] = {}
+        self._publish_tag = 0
+
+        self._retry_max_attempts = retry_max_attempts
+        self._retry_delay_ms = retry_delay_ms
+        self.RETRY_EXCHANGE = f"{exchange}.retry"
+        self.RETRY_QUEUE = f"{queue}.retry"
+        self.DEAD_EXCHANGE = f"{exchange}.dead"
+        self.DEAD_QUEUE = f"{queue}.dead"
+
+    @property
+    def prefetch_count(self) -> int:
+        return self._prefetch_count
+
+    @property
+    def in_flight(self) -> int:
+        """Delivered messages which are not acked or rejected yet."""
+        return self._acks.in_flight if self._acks is not None else 0
+
+    def derive_prefetch(self, concurrency: int) -> int:
+        """Prefetch from settings, or enough to keep `concurrency` workers
+        busy while a whole batch of finished messages waits for its ack.
+
+        """
+        if self._prefetch_setting:
+            return self._prefetch_setting
+        return concurrency + self._ack_batch_size - 1
 
     def connect(self):
         """This method connects to RabbitMQ, returning the connection handle.
@@ -255,7 +360,49 @@ class ExampleConsumer(BasicConsumer):
 
         """
         logger.info(f'Queue bound: {userdata}')
-        self.set_qos()
+        self.setup_retry_queues()
+
+    def setup_retry_queues(self):
+        """Declare {exchange}.retry with {queue}.retry, where failed messages
+        wait retry_delay_ms and then are dead-lettered back to the main
+        exchange, and {exchange}.dead with {queue}.dead for messages which
+        failed retry_max_attempts times. The retry queue is skipped when
+        retries are off. Then turns on publisher confirms, so a failed
+        message is acked only once its copy is confirmed, and sets QoS.
+
+        """
+        logger.info(f'Declaring retry queue {self.RETRY_QUEUE} and dead queue {self.DEAD_QUEUE}')
+        channel = self._channel
+        retry_arguments = {
+            "x-message-ttl": self._retry_delay_ms,
+            "x-dead-letter-exchange": self.EXCHANGE,
+            "x-dead-letter-routing-key": self.ROUTING_KEY,
+        }
+        steps = []
+        if self._retry_max_attempts:
+            steps += [
+                lambda cb: channel.exchange_declare(
+                    exchange=self.RETRY_EXCHANGE, exchange_type=self.EXCHANGE_TYPE, durable=True, callback=cb),
+                lambda cb: channel.queue_declare(
+                    queue=self.RETRY_QUEUE, durable=True, arguments=retry_arguments, callback=cb),
+                lambda cb: channel.queue_bind(
+                    self.RETRY_QUEUE, self.RETRY_EXCHANGE, routing_key=self.ROUTING_KEY, callback=cb),
+            ]
+        self._run_steps(steps + [
+            lambda cb: channel.exchange_declare(
+                exchange=self.DEAD_EXCHANGE, exchange_type=self.EXCHANGE_TYPE, durable=True, callback=cb),
+            lambda cb: channel.queue_declare(queue=self.DEAD_QUEUE, durable=True, callback=cb),
+            lambda cb: channel.queue_bind(
+                self.DEAD_QUEUE, self.DEAD_EXCHANGE, routing_key=self.ROUTING_KEY, callback=cb),
+            lambda cb: channel.confirm_delivery(ack_nack_callback=self.on_delivery_confirmation, callback=cb),
+        ], self.set_qos)
+
+    def _run_steps(self, steps: List[Callable], done: Callable) -> None:
+        # runs asynchronous RPC commands one after another
+        if not steps:
+            done()
+            return
+        steps[0](lambda _unused_frame: self._run_steps(steps[1:], done))
 
     def set_qos(self):
         """This method sets up the consumer prefetch to only be delivered
@@ -290,6 +437,17 @@ class ExampleConsumer(BasicConsumer):
         """
         logger.info('Issuing consumer related RPC commands')
         self.add_on_cancel_callback()
+        if self._acks is not None:
+            self._acks.close()
+        # delivery tags start from 1 on every channel
+        self._acks = AckBatcher(
+            self._channel,
+            self._connection.ioloop,
+            batch_size=self._ack_batch_size,
+            interval=self._ack_batch_interval,
+        )
+        self._republished.clear()
+        self._publish_tag = 0
         self._consumer_tag = self._channel.basic_consume(
             self.QUEUE, self.on_message)
         self.was_consuming = True
@@ -333,7 +491,16 @@ class ExampleConsumer(BasicConsumer):
         logger.info(
             f'Received message # {basic_deliver.delivery_tag} from {properties.app_id}: {body}',
         )
-        self.handle_message(body)
+        self._acks.delivered(basic_deliver.delivery_tag)
+        try:
+            self.handle_message(body)
+        except Exception:
+            logger.exception(f"Message {basic_deliver.delivery_tag} failed")
+            self.reject_message(basic_deliver.delivery_tag, body, properties)
+            return
+        except BaseException:
+            self.reject_message(basic_deliver.delivery_tag, body, properties)
+            raise
         self.acknowledge_message(basic_deliver.delivery_tag)
 
     @abc.abstractmethod
@@ -348,7 +515,72 @@ class ExampleConsumer(BasicConsumer):
 
         """
         logger.info(f'Acknowledging message {delivery_tag}', )
-        self._channel.basic_ack(delivery_tag)
+        self._acks.ack(delivery_tag)
+
+    def reject_message(self, delivery_tag, body: Optional[bytes] = None, properties=None):
+        """Move a failed message out of the way, so it doesn't hold a
+        prefetch slot or block the rest of the queue.
+
+        The message is republished to the retry exchange with its
+        attempt counter in the x-attempts header, or to the dead exchange
+        once it failed retry_max_attempts times (at once without retries).
+        It is acked in on_delivery_confirmation, after the broker confirmed
+        the copy, so a lost publish only leads to a redelivery.
+
+        """
+        if body is None:
+            logger.info(f'Rejecting message {delivery_tag}', )
+            self._acks.nack(delivery_tag, requeue=True)
+            return
+
+        headers = dict(properties.headers or {}) if properties else {}
+        attempts = int(headers.get(ATTEMPTS_HEADER, 0)) + 1
+        headers[ATTEMPTS_HEADER] = attempts
+        if attempts < self._retry_max_attempts:
+            exchange = self.RETRY_EXCHANGE
+            logger.info(f'Retrying message {delivery_tag} in {self._retry_delay_ms} ms, attempt {attempts}')
+        else:
+            exchange = self.DEAD_EXCHANGE
+            logger.error(f'Message {delivery_tag} failed {attempts} times, moving it to {self.DEAD_QUEUE}')
+
+        self._channel.basic_publish(
+            exchange=exchange,
+            routing_key=self.ROUTING_KEY,
+            body=body,
+            properties=pika.BasicProperties(
+                content_type=properties.content_type if properties else None,
+                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+                priority=properties.priority if properties else None,
+                headers=headers,
+            ),
+        )
+        self._publish_tag += 1
+        self._republished[self._publish_tag] = delivery_tag
+
+    def on_delivery_confirmation(self, method_frame):
+        """Invoked by pika when RabbitMQ confirms or rejects messages
+        republished by reject_message. Confirmed originals are acked,
+        rejected ones are returned to the queue.
+
+        :param pika.frame.Method method_frame: Basic.Ack or Basic.Nack frame
+
+        """
+        method = method_frame.method
+        confirmed = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [x for x in self._republished if x <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        for tag in tags:
+            delivery_tag = self._republished.pop(tag, None)
+            if delivery_tag is None:
+                continue
+            if confirmed:
+                self._acks.ack(delivery_tag)
+            else:
+                logger.error(f'Broker did not take the copy of message {delivery_tag}, returning it to the queue')
+                self._acks.nack(delivery_tag, requeue=True)
 
     def stop_consuming(self):
         """Tell RabbitMQ that you would like to stop consuming by sending the
@@ -356,6 +588,8 @@ class ExampleConsumer(BasicConsumer):
 
         """
         if self._channel:
+            if self._acks is not None:
+                self._acks.flush()
             logger.info('Sending a Basic.Cancel RPC command to RabbitMQ')
             cb = functools.partial(
                 self.on_cancelok, userdata=self._consumer_tag)
@@ -434,6 +668,10 @@ class URLConsumer(ExampleConsumer):
         self._error_listeners: List[Callable] = saved_data.get(
             "error_listeners", []
         )
+        # compiled once in add_listener, see helpers.ListenerPlan
+        self._plans: Dict[str, List[ListenerPlan]] = saved_data.get(
+            "plans", {key: [] for key in LISTENER_METHODS}
+        )
         data = kwargs.pop("workflow_data", {})
         if saved_data:
             self.workflow_data = saved_data["workflow_data"]
@@ -446,10 +684,10 @@ class URLConsumer(ExampleConsumer):
         super().__init__(*args, **kwargs)
 
     def emit_startup(self, workflow: dict):
-        run_listeners(workflow, self._listeners, "setup")
+        run_listeners(workflow, self._plans["setup"])
 
     def emit_shutdown(self, workflow: dict):
-        run_listeners(workflow, self._listeners, "close")
+        run_listeners(workflow, self._plans["close"])
 
     def handle_message(self, body: Union[bytes, str]) -> None:
 
@@ -457,7 +695,7 @@ class URLConsumer(ExampleConsumer):
 
         self.workflow_data.update(body=body)
 
-        run_listeners(data=self.workflow_data, listeners=self._listeners)
+        process_message(self.workflow_data, self._plans["__call__"])
 
     def close_connection(self):
         self.emit_shutdown(self.workflow_data)
@@ -471,13 +709,26 @@ class URLConsumer(ExampleConsumer):
 
     def add_listener(self, listener: ListenerType):
         self._listeners.append(listener)
+        for key, plans in self._plans.items():
+            plans.append(compile_listener(listener, key))
 
-    def reconnect(self):
+    def save_state(self):
+        """Listeners and workflow data for the consumer which
+        ReconnectingURLConsumer creates after this one.
+
+        """
         self.__class__._saved_data = {
             "listeners": self._listeners,
             "error_listeners": self._error_listeners,
-            "workflow_data": self.workflow_data,
+            "plans": self._plans,
+            "workflow_data": self._workflow_to_save(),
         }
+
+    def _workflow_to_save(self) -> dict:
+        return self.workflow_data
+
+    def reconnect(self):
+        self.save_state()
         super().reconnect()
 
 
@@ -490,27 +741,48 @@ class MultiThreadedConsumer(URLConsumer):
     для того что бы туда засунуть driver и использвать несколько
     браузеров одновременно(ну там GIL не будет проблемой в основном).
 
-    TODO
+    Сообщения отправляются в пул через apply_async, так что ioloop
+    не блокируется, а ack отправляется обратно в поток ioloop-а
+    через call_soon_threadsafe когда тред закончил обработку.
+
+    `thread_setup` и `thread_teardown` вызываются в каждом треде
+    с его workflow_data, туда можно положить свою aiohttp сессию и т.д.
     """
     _thread_pool_save: ThreadPool = None
 
     def __init__(self, *args, **kwargs):
         self._threads_count = kwargs.pop("threads_count", DEFAULT_THREADS_COUNT)
+        self._thread_setup = kwargs.pop("thread_setup", None)
+        self._thread_teardown = kwargs.pop("thread_teardown", None)
 
         self._local = threading.local()
         self.default_workflow_data = kwargs.get("workflow_data", {})
 
         super().__init__(*args, **kwargs)
 
+        # keeps every thread busy while the previous ack is on its way
+        self._prefetch_count = self.derive_prefetch(self._threads_count * PREFETCH_PER_THREAD)
+
         self.workflow_data = contextvars.ContextVar(
             "workflow_data"
         )
 
+    def _workflow_to_save(self) -> dict:
+        # workflow_data is a per thread ContextVar here
+        return self.default_workflow_data
+
     def create_pool(self) -> ThreadPool:
         return ThreadPool(
             self._threads_count,
             initializer=self.setup_thread,
-            initargs=(self._local, self.workflow_data, self.default_workflow_data, self._listeners)
+            initargs=(
+                self._local,
+                self.workflow_data,
+                self.default_workflow_data,
+                self._plans,
+                self._thread_setup,
+                self._thread_teardown,
+            )
         )
 
     def emit_startup(self, workflow: dict):
@@ -519,7 +791,22 @@ class MultiThreadedConsumer(URLConsumer):
             self._thread_pool_save = self.create_pool()
 
     @staticmethod
-    def setup_thread(local, workflow_data: contextvars.ContextVar, default_data: dict, listeners: List[ListenerType]):
+    def _call_in_thread(func: Optional[Callable], data: dict) -> None:
+        if func is None:
+            return
+        result = func(data)
+        if asyncio.iscoroutine(result):
+            asyncio.get_event_loop().run_until_complete(result)
+
+    @staticmethod
+    def setup_thread(
+            local,
+            workflow_data: contextvars.ContextVar,
+            default_data: dict,
+            plans: Dict[str, List[ListenerPlan]],
+            thread_setup: Optional[Callable] = None,
+            thread_teardown: Optional[Callable] = None,
+    ):
         # https://ru.stackoverflow.com/questions/787715/runtimeerror-there-is-no-current-event-loop-in-thread-thread-2
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
@@ -531,12 +818,14 @@ class MultiThreadedConsumer(URLConsumer):
             data.update(default_data)
         data.update(data=data)
 
-        run_listeners(data, listeners, "setup")
+        MultiThreadedConsumer._call_in_thread(thread_setup, data)
+        run_listeners(data, plans["setup"])
 
         workflow_data.set(data)
 
-        local.listeners = listeners
+        local.plans = plans
         local.workflow_data = workflow_data
+        local.teardown = thread_teardown
 
     def submit_to_all_threads(self, func, value, chunk_size=None) -> List[Any]:
         """
@@ -571,9 +860,8 @@ class MultiThreadedConsumer(URLConsumer):
     @staticmethod
     def _close_thread(local):
         data = local.workflow_data.get()
-        listeners = local.listeners
-
-        run_listeners(data, listeners, "close")
+        run_listeners(data, local.plans["close"])
+        MultiThreadedConsumer._call_in_thread(local.teardown, data)
 
     @staticmethod
     def handle_message_in_thread(local, body):
@@ -582,14 +870,161 @@ class MultiThreadedConsumer(URLConsumer):
         data = local.workflow_data.get()
 
         data.update(body=body)
-        run_listeners(data, local.listeners)
+        process_message(data, local.plans["__call__"])
 
-    def handle_message(self, body: Union[bytes, str]) -> None:
-        self._thread_pool_save.apply(
+    def on_message(self, _unused_channel, basic_deliver, properties, body):
+        logger.info(
+            f'Received message # {basic_deliver.delivery_tag} from {properties.app_id}: {body}',
+        )
+        channel = self._channel
+        delivery_tag = basic_deliver.delivery_tag
+        self._acks.delivered(delivery_tag)
+
+        self.handle_message(
+            body,
+            callback=lambda _: self._threadsafe(self._on_job_done, channel, delivery_tag),
+            error_callback=lambda e: self._threadsafe(
+                self._on_job_failed, channel, delivery_tag, e, body, properties),
+        )
+
+    def handle_message(
+            self,
+            body: Union[bytes, str],
+            callback: Optional[Callable] = None,
+            error_callback: Optional[Callable] = None,
+    ) -> AsyncResult:
+        return self._thread_pool_save.apply_async(
             self.handle_message_in_thread,
             (self._local, body),
+            callback=callback,
+            error_callback=error_callback,
         )
 
+    def _threadsafe(self, func: Callable, *args) -> None:
+        # pool callbacks run in the pool's result thread,
+        # pika channels may be touched only from the ioloop thread
+        self._connection.ioloop.call_soon_threadsafe(func, *args)
+
+    def _on_job_done(self, channel, delivery_tag: int) -> None:
+        if channel is not self._channel or not channel.is_open:
+            logger.warning(f"Channel was reopened, message {delivery_tag} will be redelivered")
+            return
+        self.acknowledge_message(delivery_tag)
+
+    def _on_job_failed(self, channel, delivery_tag: int, error: BaseException, body: bytes, properties) -> None:
+        logger.opt(exception=error).error(f"Message {delivery_tag} failed in thread")
+        if channel is not self._channel or not channel.is_open:
+            return
+        self.reject_message(delivery_tag, body, properties)
+
+
+class AsyncURLConsumer(URLConsumer):
+    """
+    Асинхронная версия URLConsumer, работает прямо в loop-е AsyncioConnection
+    и не требует nest_asyncio.
+
+    На каждое сообщение создается asyncio.Task со своей копией workflow_data,
+    слушатели await-ятся напрямую, так что DB/HTTP работа нескольких сообщений
+    перекрывается. Количество одновременно обрабатываемых сообщений
+    ограничено семафором равным concurrency, ack отправляется когда таск
+    закончил работу, упавшие уходят в reject_message.
+
+    Запускается через `await consumer.serve()`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        concurrency = kwargs.pop("concurrency", DEFAULT_CONCURRENCY)
+
+        super().__init__(*args, **kwargs)
+
+        self._prefetch_count = self.derive_prefetch(concurrency)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._closed: Optional[asyncio.Future] = None
+
+    def on_message(self, _unused_channel, basic_deliver, properties, body):
+        logger.info(
+            f'Received message # {basic_deliver.delivery_tag} from {properties.app_id}: {body}',
+        )
+        self._acks.delivered(basic_deliver.delivery_tag)
+        task = asyncio.get_event_loop().create_task(
+            self._process(self._channel, basic_deliver.delivery_tag, body, properties)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, channel, delivery_tag: int, body: bytes, properties) -> None:
+        failed = False
+        async with self._semaphore:
+            try:
+                await self.handle_message(body)
+            except Exception:
+                logger.exception(f"Message {delivery_tag} failed")
+                failed = True
+
+        if channel is not self._channel or not channel.is_open:
+            logger.warning(f"Channel was reopened, message {delivery_tag} will be redelivered")
+            return
+        if failed:
+            self.reject_message(delivery_tag, body, properties)
+        else:
+            self.acknowledge_message(delivery_tag)
+
+    async def handle_message(self, body: Union[bytes, str]) -> None:
+        logger.info(f"Handling body, with body: {body}")
+
+        data = dict(self.workflow_data)
+        data.update(data=data, body=body)
+
+        await process_message_async(data, self._plans["__call__"])
+
+    def emit_shutdown(self, workflow: dict):
+        task = asyncio.get_event_loop().create_task(
+            run_listeners_async(workflow, self._plans["close"])
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def on_connection_closed(self, _unused_connection, reason):
+        self._channel = None
+        if not self._closing:
+            logger.warning(f'Connection closed, reconnect necessary: {reason}')
+            self.should_reconnect = True
+            self.save_state()
+        self._finish()
+
+    def _finish(self):
+        if self._closed and not self._closed.done():
+            self._closed.set_result(None)
+
+    def stop(self):
+        """Same as ExampleConsumer.stop but does not spin the loop,
+        serve() returns once the connection is closed.
+
+        """
+        if not self._closing:
+            self._closing = True
+            logger.info('Stopping...')
+            if self._consuming:
+                self.stop_consuming()
+            else:
+                self._finish()
+
+    def run(self):
+        raise RuntimeError("AsyncURLConsumer must be started with `await serve()`")
+
+    async def serve(self):
+        await run_listeners_async(self.workflow_data, self._plans["setup"])
+
+        self._closed = asyncio.get_running_loop().create_future()
+        self._connection = self.connect()
+        try:
+            await self._closed
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            logger.info('Stopped')
+
 
 class ReconnectingURLConsumer:
     """This is an example consumer that will reconnect if the nested
@@ -606,6 +1041,15 @@ class ReconnectingURLConsumer:
         self.tries = 0
         self.max_tries = 2
 
+    @property
+    def prefetch_count(self) -> int:
+        return self._consumer.prefetch_count
+
+    @property
+    def in_flight(self) -> int:
+        # the consumer is replaced on every reconnect, so metrics read it through here
+        return self._consumer.in_flight
+
     def run(self):
         while True:
             try:
@@ -624,13 +1068,31 @@ class ReconnectingURLConsumer:
                 self._consumer.stop()
                 break
 
+    async def serve(self):
+        """Reconnecting loop for AsyncURLConsumer."""
+        while True:
+            await self._consumer.serve()
+            if not self._consumer.should_reconnect:
+                break
+
+            reconnect_delay = self._get_reconnect_delay()
+            logger.info(f'Reconnecting after {reconnect_delay} seconds')
+            await asyncio.sleep(reconnect_delay)
+            self._consumer = self._rebuild()
+
     def _maybe_reconnect(self):
         if self._consumer.should_reconnect:
             self._consumer.stop()
             reconnect_delay = self._get_reconnect_delay()
             logger.info(f'Reconnecting after {reconnect_delay} seconds')
             time.sleep(reconnect_delay)
-            self._consumer = self._consumer_type(self._amqp_url, **self._kwargs)
+            self._consumer = self._rebuild()
+
+    def _rebuild(self) -> ExampleConsumer:
+        # the new consumer picks listeners and workflow data up from _saved_data
+        if isinstance(self._consumer, URLConsumer):
+            self._consumer.save_state()
+        return self._consumer_type(self._amqp_url, **self._kwargs)
 
     def _get_reconnect_delay(self):
         if self._consumer.was_consuming:
@@ -3,8 +3,9 @@ import functools
 import json
 import ssl
 import time
+from collections import deque
 from enum import Enum
-from typing import Dict
+from typing import Deque, Dict, List
 from typing import Optional
 
 from loguru import logger
@@ -12,8 +13,17 @@ from pika.exchange_type import ExchangeType
 from pydantic import BaseModel, validator
 
 import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
 from pika.exceptions import AMQPConnectionError
 
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 0.02
+DEFAULT_MAX_IN_FLIGHT = 1000
+DEFAULT_PUBLISH_RETRIES = 3
+DEFAULT_PUBLISH_TIMEOUT = 5
+DEFAULT_CONNECT_TIMEOUT = 30
+RECONNECT_DELAY = 5
+
 
 def sync(f):
     @functools.wraps(f)
@@ -128,6 +138,19 @@ class BasicPikaClient:
 
 
 class BasicMessageSender(BasicPikaClient):
+    def _publish(self, body: bytes, headers: Optional[Headers], exchange_name: str, routing_key: str):
+        self.channel.basic_publish(
+            exchange=exchange_name,
+            routing_key=routing_key,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+                priority=headers.priority.value if headers else None,
+                headers=headers.dict() if headers else None,
+                content_type="application/json",
+            ),
+        )
+
     def send_message(
         self,
         body: Dict,
@@ -141,20 +164,370 @@ class BasicMessageSender(BasicPikaClient):
             routing_key = self.routing
         body = bytes(json.dumps(body), 'utf8')
         if self.channel.is_open:
-            self.channel.basic_publish(
-                exchange=exchange_name,
-                routing_key=routing_key,
-                body=body,
-                properties=pika.BasicProperties(
-                    delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
-                    priority=headers.priority.value if headers else None,
-                    headers=headers.dict() if headers else None,
-                    content_type="application/json",
-                ),
-            )
+            self._publish(body, headers, exchange_name, routing_key)
             logger.info(
                 f"Sent message. Exchange: {exchange_name}, Routing Key: {routing_key}, Body: {body[:128]}"
             )
         else:
             self.check_connection()
             logger.error("RETURN CHANNEL UNEXPECTEDLY CLOSED BY PEER, TRY TO INCREASE HEARTBEAT")
+
+
+class PublishError(Exception):
+    pass
+
+
+class PublishTimeout(PublishError):
+    pass
+
+
+class _Pending:
+    __slots__ = ("body", "properties", "exchange", "routing_key", "future", "created", "attempts")
+
+    def __init__(self, body, properties, exchange, routing_key, future) -> None:
+        self.body = body
+        self.properties = properties
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.future: Optional[asyncio.Future] = future
+        self.created = time.perf_counter()
+        self.attempts = 0
+
+
+class AsyncBatchPublisher:
+    """
+    Асинхронный отправитель на AsyncioConnection с publisher confirms.
+
+    Сообщения складываются в буфер и отправляются пачками раз в
+    `flush_interval` секунд или как только набралось `batch_size`.
+    Каждое сообщение ждет confirm от брокера, неподтвержденные
+    (nack или упавшее соединение) отправляются заново после
+    переподключения, так что доставка at-least-once.
+
+    `send_message` можно звать из любого потока и loop-а, он не ждет
+    подтверждения. `publish` возвращается только после confirm,
+    или бросает PublishTimeout через `publish_timeout` секунд, если
+    брокер недоступен. Еще не отправленное сообщение тогда выбрасывается,
+    а уже отправленное может быть доставлено позже.
+
+    `start` ждет готовности канала не дольше `connect_timeout` секунд.
+    """
+
+    def __init__(
+            self,
+            amqp_url: str,
+            queue: str,
+            exchange: str,
+            routing: str,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+            max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+            max_retries: int = DEFAULT_PUBLISH_RETRIES,
+            publish_timeout: float = DEFAULT_PUBLISH_TIMEOUT,
+            connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    ) -> None:
+        self.amqp_url = amqp_url
+        self.queue = queue
+        self.exchange = exchange
+        self.routing = routing
+
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_in_flight = max_in_flight
+        self._max_retries = max_retries
+        self._publish_timeout = publish_timeout
+        self._connect_timeout = connect_timeout
+
+        self._buffer: Deque[_Pending] = deque()
+        self._unconfirmed: Dict[int, _Pending] = {}
+        self._delivery_tag = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connection: Optional[AsyncioConnection] = None
+        self._channel = None
+        self._ready: Optional[asyncio.Event] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closed: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self.published = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.retried = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.batches = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "published": self.published,
+            "confirmed": self.confirmed,
+            "nacked": self.nacked,
+            "retried": self.retried,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "batches": self.batches,
+            "buffered": len(self._buffer),
+            "in_flight": len(self._unconfirmed),
+            "confirm_latency_avg_ms": round(self._latency_sum / self.confirmed * 1000, 3) if self.confirmed else 0.0,
+            "confirm_latency_max_ms": round(self._latency_max * 1000, 3),
+        }
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._closed = asyncio.Event()
+
+        self._connect()
+        self._flusher = asyncio.create_task(self._run_flusher())
+        try:
+            await asyncio.wait_for(self._ready.wait(), self._connect_timeout)
+        except asyncio.TimeoutError:
+            self._abort()
+            raise PublishError(f"Publisher was not ready in {self._connect_timeout}s, is RabbitMQ reachable?")
+
+    def _abort(self) -> None:
+        # the connection may have never opened, so its close callback is not awaited
+        self._closing = True
+        self._flusher.cancel()
+        if self._connection is not None and not (self._connection.is_closing or self._connection.is_closed):
+            try:
+                self._connection.close()
+            except Exception as e:
+                logger.warning(f"Failed to close batch publisher connection: {e}")
+
+    # connection
+
+    def _connect(self) -> None:
+        logger.info("Connecting batch publisher")
+        self._connection = AsyncioConnection(
+            parameters=pika.URLParameters(self.amqp_url),
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._loop,
+        )
+
+    def _on_connection_open(self, connection) -> None:
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, _unused_connection, err) -> None:
+        logger.error(f"Batch publisher connection failed: {err}")
+        self._schedule_reconnect()
+
+    def _on_connection_closed(self, _unused_connection, reason) -> None:
+        self._lost()
+        if self._closing:
+            self._closed.set()
+        else:
+            logger.warning(f"Batch publisher connection closed: {reason}")
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self) -> None:
+        if not self._closing:
+            self._loop.call_later(RECONNECT_DELAY, self._reconnect)
+
+    def _reconnect(self) -> None:
+        # close() may have been called while waiting
+        if not self._closing:
+            self._connect()
+
+    def _on_channel_open(self, channel) -> None:
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.exchange_declare(
+            exchange=self.exchange,
+            exchange_type=ExchangeType.direct,
+            durable=True,
+            callback=lambda _: channel.queue_declare(queue=self.queue, callback=self._on_queue_declareok),
+        )
+
+    def _on_queue_declareok(self, _unused_frame) -> None:
+        self._channel.confirm_delivery(ack_nack_callback=self._on_confirm, callback=self._on_confirm_selectok)
+
+    def _on_confirm_selectok(self, _unused_frame) -> None:
+        # delivery tags start from 1 again on every channel
+        self._delivery_tag = 0
+        self._ready.set()
+        self._wakeup.set()
+        logger.info("Batch publisher is ready")
+
+    def _on_channel_closed(self, _unused_channel, reason) -> None:
+        self._lost()
+        if self._closing:
+            return
+        logger.warning(f"Batch publisher channel closed: {reason}")
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def _lost(self) -> None:
+        self._ready.clear()
+        self._channel = None
+        if self._unconfirmed:
+            # the broker may or may not have them, send them again in order
+            self.retried += len(self._unconfirmed)
+            self._buffer.extendleft(reversed(list(self._unconfirmed.values())))
+            self._unconfirmed.clear()
+
+    # publishing
+
+    def _enqueue(self, body: bytes, headers: Optional[Headers], exchange: str, routing_key: str, future) -> None:
+        properties = pika.BasicProperties(
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+            priority=headers.priority.value if headers else None,
+            headers=headers.dict() if headers else None,
+            content_type="application/json",
+        )
+        self._buffer.append(_Pending(body, properties, exchange, routing_key, future))
+        if len(self._buffer) >= self._batch_size:
+            self._wakeup.set()
+
+    def _encode(self, body: Dict, exchange_name: Optional[str], routing_key: Optional[str]):
+        return bytes(json.dumps(body), 'utf8'), exchange_name or self.exchange, routing_key or self.routing
+
+    def send_message(
+        self,
+        body: Dict,
+        headers: Optional[Headers] = None,
+        exchange_name: str = None,
+        routing_key: str = None,
+    ) -> None:
+        if self._loop is None:
+            raise RuntimeError("AsyncBatchPublisher.start() was not called")
+
+        payload, exchange, routing = self._encode(body, exchange_name, routing_key)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._enqueue(payload, headers, exchange, routing, None)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, payload, headers, exchange, routing, None)
+
+    async def publish(
+        self,
+        body: Dict,
+        headers: Optional[Headers] = None,
+        exchange_name: str = None,
+        routing_key: str = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        if self._loop is None:
+            raise RuntimeError("AsyncBatchPublisher.start() was not called")
+        if asyncio.get_running_loop() is not self._loop:
+            future = asyncio.run_coroutine_threadsafe(
+                self.publish(body, headers, exchange_name, routing_key, timeout), self._loop)
+            return await asyncio.wrap_future(future)
+
+        payload, exchange, routing = self._encode(body, exchange_name, routing_key)
+        future = self._loop.create_future()
+        self._enqueue(payload, headers, exchange, routing, future)
+        try:
+            # wait_for cancels the future, flush then skips the message if it was not sent yet
+            await asyncio.wait_for(future, timeout if timeout is not None else self._publish_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PublishTimeout("Message was not confirmed in time")
+
+    async def _run_flusher(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        if not self._ready.is_set() or self._channel is None:
+            return 0
+
+        sent = 0
+        while self._buffer and len(self._unconfirmed) < self._max_in_flight:
+            pending = self._buffer.popleft()
+            if pending.attempts == 0 and pending.future is not None and pending.future.cancelled():
+                # the caller gave up before it was sent
+                continue
+            pending.attempts += 1
+            self._channel.basic_publish(
+                exchange=pending.exchange,
+                routing_key=pending.routing_key,
+                body=pending.body,
+                properties=pending.properties,
+            )
+            self._delivery_tag += 1
+            self._unconfirmed[self._delivery_tag] = pending
+            sent += 1
+
+        if sent:
+            self.published += sent
+            self.batches += 1
+        return sent
+
+    def _on_confirm(self, frame) -> None:
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+
+        if method.multiple:
+            tags: List[int] = []
+            for tag in self._unconfirmed:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = [method.delivery_tag]
+
+        now = time.perf_counter()
+        for tag in tags:
+            pending = self._unconfirmed.pop(tag, None)
+            if pending is None:
+                continue
+            if acked:
+                self._confirmed(pending, now)
+            else:
+                self._nacked(pending)
+
+    def _confirmed(self, pending: _Pending, now: float) -> None:
+        self.confirmed += 1
+        latency = now - pending.created
+        self._latency_sum += latency
+        self._latency_max = max(self._latency_max, latency)
+        if pending.future is not None and not pending.future.done():
+            pending.future.set_result(None)
+
+    def _nacked(self, pending: _Pending) -> None:
+        self.nacked += 1
+        if pending.attempts < self._max_retries:
+            self.retried += 1
+            self._buffer.append(pending)
+            return
+
+        self.failed += 1
+        logger.error(f"Broker rejected message {pending.attempts} times: {pending.body[:128]}")
+        if pending.future is not None and not pending.future.done():
+            pending.future.set_exception(PublishError("Message was nacked by the broker"))
+
+    async def close(self, timeout: float = 5) -> None:
+        # give buffered and in flight messages a chance to be confirmed
+        deadline = time.monotonic() + timeout
+        while (self._buffer or self._unconfirmed) and self._ready.is_set() and time.monotonic() < deadline:
+            self._wakeup.set()
+            await asyncio.sleep(self._flush_interval)
+        left = list(self._buffer) + list(self._unconfirmed.values())
+        if left:
+            logger.warning(f"Closing publisher with {len(left)} unconfirmed messages")
+        for pending in left:
+            if pending.future is not None and not pending.future.done():
+                pending.future.set_exception(PublishError("Publisher was closed"))
+
+        self._closing = True
+        if self._flusher is not None:
+            self._flusher.cancel()
+        if self._connection is not None and not (self._connection.is_closing or self._connection.is_closed):
+            self._connection.close()
+            await self._closed.wait()
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Optional, Set
+
+from loguru import logger
+
+from app.repos import UserTokenRepository
+
+DEFAULT_REFRESH_INTERVAL = 60
+REFRESH_BATCH = 1000
+
+
+class TokenPool:
+    """
+    Активные токены в памяти процесса.
+
+    Токены загружаются один раз и выдаются в аренду через `lease()`,
+    так что два воркера никогда не используют один аккаунт одновременно.
+    Новые токены подгружаются инкрементально по id, а уже известные
+    сверяются с бд при каждом `refresh`, и деактивированные не этим
+    процессом выкидываются из пула. `mark_as_inactive` записывается
+    в бд в фоне, на loop-е в котором был вызван `load()`.
+
+    Все операции кроме `load`/`refresh` O(1) и потокобезопасны.
+    """
+
+    def __init__(self, repo: UserTokenRepository, refresh_interval: float = DEFAULT_REFRESH_INTERVAL) -> None:
+        self._repo = repo
+        self._refresh_interval = refresh_interval
+
+        self._free: Deque[str] = deque()
+        self._leased: Set[str] = set()
+        self._known: Set[str] = set()
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writes: Set[Future] = set()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._free) + len(self._leased)
+
+    @property
+    def free(self) -> int:
+        return len(self._free)
+
+    async def load(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        await self.refresh()
+
+        logger.info(f"Token pool loaded {len(self)} tokens")
+
+    async def refresh(self) -> int:
+        added = 0
+        while True:
+            records = await self._repo.fetch_active_tokens_after(self._last_id, REFRESH_BATCH)
+            if not records:
+                break
+
+            with self._lock:
+                for record in records:
+                    token = record.get("token")
+                    self._last_id = max(self._last_id, record.get("id"))
+                    if not token or token in self._known:
+                        continue
+
+                    self._known.add(token)
+                    if record.get("is_selected"):
+                        # selected tokens are handed out first
+                        self._free.appendleft(token)
+                    else:
+                        self._free.append(token)
+                    added += 1
+
+            if len(records) < REFRESH_BATCH:
+                break
+
+        if added:
+            logger.info(f"Token pool got {added} new tokens")
+
+        await self._evict_inactive()
+        return added
+
+    async def _evict_inactive(self) -> int:
+        with self._lock:
+            known = list(self._known)
+
+        inactive: Set[str] = set()
+        for i in range(0, len(known), REFRESH_BATCH):
+            batch = known[i:i + REFRESH_BATCH]
+            inactive.update(set(batch) - set(await self._repo.fetch_active_among(batch)))
+        if not inactive:
+            return 0
+
+        with self._lock:
+            for token in inactive:
+                self._known.discard(token)
+                # release() ignores tokens which are not leased, so a leased one is just dropped
+                self._leased.discard(token)
+            self._free = deque(x for x in self._free if x not in inactive)
+
+        logger.info(f"Token pool evicted {len(inactive)} inactive tokens")
+        return len(inactive)
+
+    async def run_refresher(self) -> None:
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Token pool refresh failed: {e}")
+
+    def lease(self) -> Optional[str]:
+        with self._lock:
+            if not self._free:
+                return None
+            token = self._free.popleft()
+            self._leased.add(token)
+            return token
+
+    def release(self, token: str) -> None:
+        with self._lock:
+            if token in self._leased:
+                self._leased.discard(token)
+                self._free.append(token)
+
+    def mark_as_inactive(self, token: str) -> None:
+        with self._lock:
+            if token in self._leased:
+                self._leased.discard(token)
+            elif token in self._known:
+                try:
+                    self._free.remove(token)
+                except ValueError:
+                    pass
+            self._known.discard(token)
+
+        self._write_behind(token)
+
+    def _write_behind(self, token: str) -> None:
+        if self._loop is None:
+            raise RuntimeError("TokenPool.load() was not called")
+
+        future = asyncio.run_coroutine_threadsafe(self._repo.mark_as_inactive(token), self._loop)
+        self._writes.add(future)
+        future.add_done_callback(self._on_written)
+
+    def _on_written(self, future: Future) -> None:
+        self._writes.discard(future)
+        if future.exception():
+            logger.error(f"Failed to mark token as inactive: {future.exception()}")
+
+    async def close(self) -> None:
+        if self._writes:
+            await asyncio.gather(*(asyncio.wrap_future(x) for x in list(self._writes)), return_exceptions=True)
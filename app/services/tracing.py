@@ -0,0 +1,171 @@
+"""
+Спаны вокруг шагов покупки, ключ трейса - tx_id.
+
+Куда уходят спаны решает sink: лог, OpenTelemetry или кольцевой
+буфер в памяти. Без sink-а `Tracer.span` ничего не измеряет.
+"""
+import abc
+import contextvars
+import functools
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+DEFAULT_TRACE_BUFFER_SIZE = 1000
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "started_at", "duration", "error",
+                 "handle", "_started")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[int], attributes: Dict[str, Any]) -> None:
+        self.trace_id = trace_id
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        # span of the sink itself, if it has one (OpenTelemetrySink)
+        self.handle: Any = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._started
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class SpanSink(abc.ABC):
+    def start(self, span: Span, parent: Optional[Span]) -> None:
+        pass
+
+    @abc.abstractmethod
+    def emit(self, span: Span) -> None:
+        pass
+
+
+class LogSink(SpanSink):
+    def emit(self, span: Span) -> None:
+        logger.bind(span=span.dict()).info(f"span {span.name} {span.duration * 1000:.1f} ms")
+
+
+class MemorySink(SpanSink):
+    """
+    Последние `size` спанов, для тестов и отладки.
+    """
+
+    def __init__(self, size: int = DEFAULT_TRACE_BUFFER_SIZE) -> None:
+        self.spans: Deque[Span] = deque(maxlen=size)
+
+    def emit(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def trace(self, trace_id) -> List[Span]:
+        trace_id = str(trace_id)
+        return [span for span in self.spans if span.trace_id == trace_id]
+
+
+class OpenTelemetrySink(SpanSink):
+    """
+    Отдает спаны OpenTelemetry tracer-у, экспортер настраивается
+    через TracerProvider как обычно. OTel спан открывается вместе
+    со своим Span и лежит в `Span.handle`, дочерние спаны открываются
+    в его контексте, так что все шаги одной покупки (один tx_id)
+    попадают в один трейс.
+    """
+
+    def __init__(self, instrumentation_name: str = "app.worker") -> None:
+        try:
+            from opentelemetry import trace
+            from opentelemetry.trace import Status, StatusCode
+        except ImportError:
+            raise RuntimeError("trace_sink=otel requires the opentelemetry-api package")
+
+        self._trace = trace
+        self._error_status = functools.partial(Status, StatusCode.ERROR)
+        self._tracer = trace.get_tracer(instrumentation_name)
+
+    def start(self, span: Span, parent: Optional[Span]) -> None:
+        context = None
+        if parent is not None and parent.handle is not None:
+            context = self._trace.set_span_in_context(parent.handle)
+        span.handle = self._tracer.start_span(
+            span.name,
+            context=context,
+            start_time=int(span.started_at * 1e9),
+            attributes={"tx_id": span.trace_id},
+        )
+
+    def emit(self, span: Span) -> None:
+        otel_span = span.handle
+        if otel_span is None:
+            return
+        otel_span.set_attributes(span.attributes)
+        if span.error is not None:
+            otel_span.set_status(self._error_status(span.error))
+        otel_span.end(end_time=int(span.started_at * 1e9) + int(span.duration * 1e9))
+
+
+class Tracer:
+    def __init__(self, sink: Optional[SpanSink] = None) -> None:
+        self.sink = sink
+
+    @contextmanager
+    def span(self, name: str, trace_id: Any, **attributes: Any) -> Iterator[Optional[Span]]:
+        if self.sink is None:
+            yield None
+            return
+
+        parent = _current_span.get()
+        span = Span(name, str(trace_id), parent.span_id if parent is not None else None, attributes)
+        try:
+            self.sink.start(span, parent)
+        except Exception as e:
+            logger.warning(f"Failed to start span {name}: {e}")
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+            try:
+                self.sink.emit(span)
+            except Exception as e:
+                logger.warning(f"Failed to emit span {name}: {e}")
+
+
+def get_tracer(sink: str = "", buffer_size: int = DEFAULT_TRACE_BUFFER_SIZE) -> Tracer:
+    if not sink:
+        return Tracer()
+    if sink == "log":
+        return Tracer(LogSink())
+    if sink == "memory":
+        return Tracer(MemorySink(buffer_size))
+    if sink == "otel":
+        return Tracer(OpenTelemetrySink())
+    raise ValueError(f"Unknown trace sink: {sink}")
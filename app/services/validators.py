@@ -1,10 +1,18 @@
 import re
+from typing import Optional
 
 
 url_validator_re = re.compile(r"https?:\/\/(www)?\.roblox\.com\/game-pass\/(\d*)\/")
 full_url_validator_re = re.compile(r"https?:\/\/(www)?\.roblox\.com\/game-pass\/(\d*)/(\w*)?")
 
 
+def extract_game_pass_id(url: str) -> Optional[int]:
+    match = url_validator_re.search(url) or full_url_validator_re.search(url)
+    if not match or not match.group(2):
+        return None
+    return int(match.group(2))
+
+
 def validate_game_pass_url(url: str) -> bool:
     match = url_validator_re.search(url)
 
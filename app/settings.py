@@ -2,7 +2,9 @@ from functools import lru_cache
 from typing import List
 
 from pydantic import BaseSettings
-from app.consts import DEFAULT_QUEUE_NAME, DEFAULT_EXCHANGE_NAME, DEFAULT_SEND_NAME, DEFAULT_SEND_EXCHANGE_NAME
+from app.consts import DEFAULT_QUEUE_NAME, DEFAULT_EXCHANGE_NAME, DEFAULT_SEND_NAME, DEFAULT_SEND_EXCHANGE_NAME, \
+    DEFAULT_DRIVERS_COUNT, DEFAULT_DRIVER_MAX_USES, ROBLOX_ECONOMY_URL, ROBLOX_AUTH_URL, \
+    ROBLOX_USERS_URL
 
 
 class Settings(BaseSettings):
@@ -26,6 +28,41 @@ class Settings(BaseSettings):
     browser: str = "Chrome"
     browser_dsn: str = ""  # uses only when we are using remote browser
 
+    token_refresh_interval: int = 60
+
+    drivers_count: int = DEFAULT_DRIVERS_COUNT
+    driver_max_uses: int = DEFAULT_DRIVER_MAX_USES
+
+    purchase_engine: str = "browser"  # browser или http, http откатывается на браузер
+    roblox_economy_url: str = ROBLOX_ECONOMY_URL
+    roblox_auth_url: str = ROBLOX_AUTH_URL
+    roblox_users_url: str = ROBLOX_USERS_URL
+
+    balance_resync_interval: int = 300
+
+    processed_table: str = "processed_transactions"
+    processed_cache_size: int = 10000
+    processed_claim_ttl: int = 600  # секунды, потом claim упавшего воркера можно забрать
+
+    publisher_batch_size: int = 100
+    publisher_flush_interval_ms: int = 20
+    publisher_max_in_flight: int = 1000
+    publisher_timeout_ms: int = 5000
+    publisher_connect_timeout_ms: int = 30000
+
+    consumer_mode: str = "sync"  # sync, threads или async
+    prefetch_count: int = 0  # 0 - считается из threads_count/concurrency
+    ack_batch_size: int = 1  # 1 - ack на каждое сообщение сразу
+    ack_batch_interval_ms: int = 50
+    retry_max_attempts: int = 3  # 0 - упавшие сообщения сразу уходят в dead очередь
+    retry_delay_ms: int = 5000
+    threads_count: int = 1  # для threads
+    concurrency: int = 4  # для async
+
+    metrics_port: int = 0  # 0 - метрики выключены
+    trace_sink: str = ""  # log, memory или otel, пусто - трейсинг выключен
+    trace_buffer_size: int = 1000  # для memory
+
     loggers: List[str] = []
 
     class Config:
@@ -0,0 +1,30 @@
+"""added tx_id
+
+Revision ID: 3c2b9e1d4f60
+Revises: a0fd3f38c759
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c2b9e1d4f60'
+down_revision: Union[str, None] = 'a0fd3f38c759'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('transactions_tx_id_seq')))
+    op.add_column('transactions', sa.Column('tx_id', sa.BIGINT(), nullable=True))
+    op.create_unique_constraint('transactions_tx_id_key', 'transactions', ['tx_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('transactions_tx_id_key', 'transactions', type_='unique')
+    op.drop_column('transactions', 'tx_id')
+    op.execute(sa.schema.DropSequence(sa.Sequence('transactions_tx_id_seq')))
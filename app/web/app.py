@@ -3,55 +3,121 @@
 делать поиск по имени геймпасса, отправлять в очередь для покупки геймпасса
 делать поиск по нику игрока (по 3 апи, и менять их по очереди), и фильтровать ввод
 """
+import functools
 from contextlib import asynccontextmanager
-from typing import Callable
+from typing import Callable, Optional
 
 from aiohttp import ClientSession
 from dotenv import load_dotenv
 from fastapi import FastAPI
 
 from app.browser import auth_browser
+from app.services.queue.publisher import AsyncBatchPublisher
 from app.services.driver import get_driver
 from app.settings import get_settings
-from app.web.db import registry
+from app.web.coalescing import CoalescingClient
+from app.web.driver_pool import WebDriverPool
+from app.web.db import registry, setup_engine, sa_session_factory
 from app.web.logger import configure_logging, LoggingSettings
 from app.web.middlewares.init import load_middlewares
 from app.web.models import load_models
-from app.web.provider import get_client, get_roblox_token_repo
+from app.web.provider import get_client, get_roblox_token_repo, create_redis
+from app.web.roblox import UniverseResolver, GamePassCache
 from app.web.routes import load_routes
 from app.web.websettings import get_web_settings
 
 
-def lifespan() -> Callable:
+def lifespan(
+	driver_factory: Optional[Callable] = None,
+	publisher_factory: Optional[Callable[[], AsyncBatchPublisher]] = None,
+) -> Callable:
+	"""
+	:param driver_factory: создает WebDriver-ы пула, по умолчанию настоящий браузер
+	:param publisher_factory: создает паблишер, по умолчанию AsyncBatchPublisher из настроек
+	"""
 	@asynccontextmanager
 	async def inner(app: FastAPI):
+		websettings = get_web_settings()
+		engine = setup_engine(
+			websettings.db_dsn,
+			pool_size=websettings.db_pool_size,
+			max_overflow=websettings.db_max_overflow,
+			pool_recycle=websettings.db_pool_recycle,
+			pool_timeout=websettings.db_pool_timeout,
+		)
+		app.state.db_engine = engine
+		app.state.session_factory = sa_session_factory(engine)
+		app.state.redis = create_redis(websettings)
+
 		token_repo, connection = await get_roblox_token_repo()
 		token = await token_repo.fetch_token()
 
 		aiohttp_client = get_client(token)
 		settings = get_settings()
-		driver = get_driver(settings)
-		await auth_browser(driver, token_service=token_repo)
+		driver_pool = WebDriverPool(
+			driver_factory or functools.partial(get_driver, settings), size=websettings.web_drivers_count)
+		await driver_pool.start()
+		async with driver_pool.lease() as pooled:
+			# finds a working token and marks the broken ones as inactive
+			bot_token = await auth_browser(pooled.driver, token_service=token_repo)
+			if bot_token:
+				pooled.token, pooled.authed = bot_token, True
+				driver_pool.select_token(bot_token)
+		if publisher_factory is not None:
+			publisher = publisher_factory()
+		else:
+			publisher = AsyncBatchPublisher(
+				settings.queue_dsn,
+				queue=settings.queue_name,
+				exchange=settings.exchange_name,
+				routing=settings.queue_name,
+				batch_size=settings.publisher_batch_size,
+				flush_interval=settings.publisher_flush_interval_ms / 1000,
+				max_in_flight=settings.publisher_max_in_flight,
+				publish_timeout=settings.publisher_timeout_ms / 1000,
+				connect_timeout=settings.publisher_connect_timeout_ms / 1000,
+			)
+		await publisher.start()
 		try:
+			app.state.publisher = publisher
 			app.state.client_session = aiohttp_client
-			app.state.driver = driver
+			app.state.roblox_client = CoalescingClient(aiohttp_client, upstream_url=websettings.roblox_upstream_url)
+			app.state.driver_pool = driver_pool
+			app.state.universe_resolver = UniverseResolver(
+				app.state.redis, app.state.roblox_client, capacity=websettings.universe_cache_size)
+			app.state.gamepass_cache = GamePassCache(
+				app.state.redis,
+				app.state.roblox_client,
+				fresh_ttl=websettings.gamepass_fresh_ttl,
+				stale_ttl=websettings.gamepass_stale_ttl,
+			)
 			yield
 		finally:
 			await app.state.client_session.close()
+			await driver_pool.close()
+			await publisher.close()
+			await engine.dispose()
+			await app.state.redis.aclose(close_connection_pool=True)
 	return inner
 
 
-async def get_app(debug: bool = True) -> FastAPI:
+async def get_app(
+	debug: bool = True,
+	driver_factory: Optional[Callable] = None,
+	publisher_factory: Optional[Callable[[], AsyncBatchPublisher]] = None,
+) -> FastAPI:
 	load_dotenv()
 
 	app = FastAPI(
-		debug=debug, lifespan=lifespan(), docs_url="/api/docs", openapi_url="/api/openapi.json")
+		debug=debug,
+		lifespan=lifespan(driver_factory, publisher_factory),
+		docs_url="/api/docs", openapi_url="/api/openapi.json")
 
 	websettings = get_web_settings()
 
 	configure_logging(LoggingSettings(path=websettings.log_path))
 
-	load_middlewares(app)
+	load_middlewares(app, log_sample_rate=websettings.log_sample_rate)
 	load_models(registry)
 	load_routes(app)
 
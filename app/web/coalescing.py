@@ -0,0 +1,145 @@
+import asyncio
+import json
+import re
+from typing import Any, Awaitable, Callable, Generator, Hashable, TypeVar
+
+from aiohttp import ClientSession
+from multidict import CIMultiDictProxy
+
+from app.web.logger import get_logger
+
+logger = get_logger()
+
+T = TypeVar("T")
+
+ROBLOX_URL_RE = re.compile(r"^https://([a-z0-9-]+)\.roblox\.com(/.*)?$")
+
+
+def rewrite_roblox_url(url: str, upstream_url: str) -> str:
+	"""
+	https://economy.roblox.com/v1/... -> {upstream_url}/economy/v1/...,
+	так устроен bench.fake_roblox.
+	"""
+	match = ROBLOX_URL_RE.match(url)
+	if match is None:
+		return url
+	return f"{upstream_url.rstrip('/')}/{match[1]}{match[2] or ''}"
+
+
+class SingleFlight:
+	"""
+	Одновременные вызовы с одним ключом получают результат одной задачи.
+	"""
+
+	def __init__(self) -> None:
+		self._inflight: dict[Hashable, asyncio.Task] = {}
+
+	def __contains__(self, key: Hashable) -> bool:
+		return key in self._inflight
+
+	def spawn(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> asyncio.Task:
+		task = self._inflight.get(key)
+		if task is None:
+			task = asyncio.ensure_future(factory())
+			self._inflight[key] = task
+			task.add_done_callback(lambda _: self._inflight.pop(key, None))
+		return task
+
+	async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+		# one cancelled caller must not cancel the others waiting for it
+		return await asyncio.shield(self.spawn(key, factory))
+
+
+class CoalescedResponse:
+	"""
+	Прочитанный ответ, его можно отдать нескольким вызывающим.
+	"""
+
+	def __init__(self, status: int, headers: CIMultiDictProxy, body: bytes) -> None:
+		self.status = status
+		self.headers = headers
+		self._body = body
+
+	async def read(self) -> bytes:
+		return self._body
+
+	async def text(self, encoding: str = "utf-8") -> str:
+		return self._body.decode(encoding)
+
+	async def json(self) -> Any:
+		return json.loads(self._body)
+
+	def release(self) -> None:
+		pass
+
+
+class _RequestContext:
+	# like aiohttp, works both with `await` and `async with`
+	def __init__(self, coro: Awaitable[CoalescedResponse]) -> None:
+		self._coro = coro
+
+	def __await__(self) -> Generator[Any, None, CoalescedResponse]:
+		return self._coro.__await__()
+
+	async def __aenter__(self) -> CoalescedResponse:
+		return await self._coro
+
+	async def __aexit__(self, *args) -> None:
+		pass
+
+
+class CoalescingClient:
+	"""
+	Обертка над ClientSession для запросов в роблокс.
+
+	Одинаковые запросы (метод, url и все аргументы, включая тело),
+	которые идут одновременно, делают один запрос в роблокс и получают
+	один и тот же ответ. Все запросы веб сервиса в роблокс только
+	читают данные, поэтому склеиваются любые методы.
+
+	С `upstream_url` запросы в *.roblox.com уходят на него, для нагрузочных тестов.
+	"""
+
+	def __init__(self, session: ClientSession, upstream_url: str = "") -> None:
+		self._session = session
+		self._upstream_url = upstream_url
+		self._flight = SingleFlight()
+
+		self.issued = 0
+		self.coalesced = 0
+
+	def stats(self) -> dict[str, int]:
+		return {
+			"issued": self.issued,
+			"coalesced": self.coalesced,
+		}
+
+	@staticmethod
+	def _key(method: str, url: str, kwargs: dict) -> tuple[str, str, str]:
+		return method.upper(), str(url), json.dumps(kwargs, sort_keys=True, default=str)
+
+	def request(self, method: str, url: str, **kwargs) -> _RequestContext:
+		return _RequestContext(self._request(method, url, **kwargs))
+
+	def get(self, url: str, **kwargs) -> _RequestContext:
+		return self.request("GET", url, **kwargs)
+
+	def post(self, url: str, **kwargs) -> _RequestContext:
+		return self.request("POST", url, **kwargs)
+
+	async def _request(self, method: str, url: str, **kwargs) -> CoalescedResponse:
+		if self._upstream_url:
+			url = rewrite_roblox_url(str(url), self._upstream_url)
+		key = self._key(method, url, kwargs)
+		if key in self._flight:
+			self.coalesced += 1
+		else:
+			self.issued += 1
+		return await self._flight.do(key, lambda: self._send(method, url, **kwargs))
+
+	async def _send(self, method: str, url: str, **kwargs) -> CoalescedResponse:
+		async with self._session.request(method, url, **kwargs) as response:
+			return CoalescedResponse(response.status, response.headers, await response.read())
+
+	async def close(self) -> None:
+		await self._session.close()
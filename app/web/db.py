@@ -33,11 +33,22 @@ def create_registry() -> registry_class:
 registry = create_registry()
 
 
-def setup_engine(dsn: str, echo: bool = False) -> AsyncEngine:
+def setup_engine(
+		dsn: str,
+		echo: bool = False,
+		pool_size: int = 20,
+		max_overflow: int = 10,
+		pool_recycle: int = -1,
+		pool_timeout: float = 30,
+) -> AsyncEngine:
 	engine = create_async_engine(
 		dsn,
 		echo_pool=echo,
-		pool_size=50,
+		pool_size=pool_size,
+		max_overflow=max_overflow,
+		pool_recycle=pool_recycle,
+		pool_timeout=pool_timeout,
+		pool_pre_ping=True,
 	)
 	return engine
 
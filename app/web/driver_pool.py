@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from app.browser import auth, is_authed
+from app.web.logger import get_logger
+from app.web.offload import AsyncDriver
+
+DEFAULT_WEB_DRIVERS_COUNT = 2
+
+logger = get_logger()
+
+
+def _authenticate(driver: WebDriver, token: str) -> bool:
+	auth(driver, token)
+	return is_authed(driver)
+
+
+class PooledDriver(AsyncDriver):
+	"""
+	Драйвер из пула, помнит каким токеном он авторизован.
+	"""
+
+	def __init__(self, driver: WebDriver, executor: ThreadPoolExecutor) -> None:
+		super().__init__(driver, executor)
+		self.token: Optional[str] = None
+		self.authed = False
+
+	async def authenticate(self, token: str) -> bool:
+		self.authed = await self.run(_authenticate, token)
+		self.token = token
+		return self.authed
+
+
+class WebDriverPool:
+	"""
+	Браузеры веб сервиса.
+
+	Каждый запрос берет себе драйвер через `lease()`, так что два запроса
+	никогда не навигируют один браузер одновременно. Пул помнит каким
+	токеном авторизован каждый драйвер, и если выбран другой токен
+	(`select_token`), драйвер переавторизуется при следующей выдаче.
+	"""
+
+	def __init__(self, factory: Callable[[], WebDriver], size: int = DEFAULT_WEB_DRIVERS_COUNT) -> None:
+		if size < 1:
+			raise ValueError("Pool size must be positive")
+
+		self._factory = factory
+		self._size = size
+		self._token: Optional[str] = None
+
+		self._drivers: list[PooledDriver] = []
+		self._queue: asyncio.Queue[PooledDriver] = asyncio.Queue()
+		self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="webdriver")
+
+	@property
+	def token(self) -> Optional[str]:
+		return self._token
+
+	def select_token(self, token: str) -> None:
+		self._token = token
+
+	async def start(self, token: Optional[str] = None) -> None:
+		loop = asyncio.get_running_loop()
+		drivers = await asyncio.gather(*(loop.run_in_executor(self._executor, self._factory) for _ in range(self._size)))
+		self._drivers = [PooledDriver(x, self._executor) for x in drivers]
+
+		if token:
+			self.select_token(token)
+			await asyncio.gather(*(x.authenticate(token) for x in self._drivers))
+		for pooled in self._drivers:
+			self._queue.put_nowait(pooled)
+
+		logger.info(f"Web driver pool started with {self._size} drivers")
+
+	@asynccontextmanager
+	async def lease(self) -> AsyncIterator[PooledDriver]:
+		pooled = await self._queue.get()
+		try:
+			if self._token and pooled.token != self._token:
+				logger.info("Driver uses another token, authenticating again")
+				await pooled.authenticate(self._token)
+			yield pooled
+		finally:
+			self._queue.put_nowait(pooled)
+
+	async def close(self) -> None:
+		await asyncio.gather(*(x.run(lambda driver: driver.quit()) for x in self._drivers), return_exceptions=True)
+		self._drivers = []
+		self._executor.shutdown(wait=False)
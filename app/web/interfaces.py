@@ -37,6 +37,10 @@ class ITransactionsRepo(ABC):
 	async def add_transaction(self, entity: TransactionEntity) -> UUID:
 		pass
 
+	@abstractmethod
+	async def next_tx_id(self) -> int:
+		pass
+
 	@abstractmethod
 	async def get_transactions(self, roblox_name: str | None) -> Sequence[TransactionEntity]:
 		pass
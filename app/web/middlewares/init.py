@@ -12,7 +12,8 @@ origins = [
 
 def load_middlewares(
         app: FastAPI,
-        debug: bool = False
+        debug: bool = False,
+        log_sample_rate: float = 1.0,
 ) -> None:
     app.add_middleware(
         CORSMiddleware,
@@ -22,4 +23,4 @@ def load_middlewares(
         allow_headers=["*"],
     )
 
-    app.add_middleware(LoggingMiddleware, debug=debug)
+    app.add_middleware(LoggingMiddleware, debug=debug, sample_rate=log_sample_rate)
@@ -1,108 +1,159 @@
+import contextvars
+import random
 import time
-import orjson
-from fastapi import FastAPI
-from pydantic import BaseModel
-
-from starlette.middleware.base import RequestResponseEndpoint, BaseHTTPMiddleware
+from typing import Optional
 
-from starlette.requests import Request
-from starlette.responses import Response
+import orjson
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.web.logger import get_logger
-from app.web.schemas import ErrorResult
 
 PORT = '8000'
 EMPTY_VALUE = ""
 logger = get_logger()
 
+# запрос, который сейчас логируется, для patch-ей LoggingMiddleware
+_logged_request: contextvars.ContextVar[tuple] = contextvars.ContextVar("logged_request")
+
 
-class RequestJsonLogSchema(BaseModel):
+# заголовки, которые попадают в поля лога
+_LOGGED_HEADERS = (b"host", b"referer", b"content-length", b"content-type")
+
+
+def _get_headers(scope: Scope) -> dict:
 	"""
-	Схема части запросов-ответов лога в формате JSON
+	Нужные для лога заголовки за один проход по scope
+	"""
+	found = {}
+	for key, value in scope.get("headers", ()):
+		if key in _LOGGED_HEADERS and key not in found:
+			found[key] = value.decode("latin-1")
+	return found
+
+
+def get_protocol(scope: Scope) -> str:
+	protocol = str(scope.get('type', ''))
+	http_version = str(scope.get('http_version', ''))
+	if protocol.lower() == 'http' and http_version:
+		return f'{protocol.upper()}/{http_version}'
+	return EMPTY_VALUE
+
+
+def get_url(scope: Scope, host: str = EMPTY_VALUE) -> str:
+	scheme = scope.get("scheme", "http")
+	if not host:
+		server = scope.get("server") or ('localhost', PORT)
+		host = f"{server[0]}:{server[1]}"
+	url = f"{scheme}://{host}{scope.get('root_path', '')}{scope['path']}"
+	query = scope.get("query_string", b"")
+	if query:
+		url = f"{url}?{query.decode('latin-1')}"
+	return url
+
+
+def request_json_fields(scope: Scope, status_code: int, duration: float) -> dict:
 	"""
-	request_uri: str
-	request_referer: str
-	request_protocol: str
-	request_method: str
-	request_path: str
-	request_host: str
-	request_size: int
-	request_content_type: str
-	request_headers: str
-	request_direction: str
-	remote_ip: str
-	remote_port: str
-	duration: float
-
-
-class LoggingMiddleware(BaseHTTPMiddleware):
+	Поля запроса-ответа для лога в формате JSON
 	"""
-	Middleware для обработки запросов и ответов с целью журналирования
+	server: tuple = scope.get('server') or ('localhost', PORT)
+	client: tuple = scope.get('client') or (EMPTY_VALUE, EMPTY_VALUE)
+	headers = _get_headers(scope)
+	content_length = headers.get(b"content-length", EMPTY_VALUE)
+	return {
+		"request_uri": get_url(scope, headers.get(b"host", EMPTY_VALUE)),
+		"request_referer": headers.get(b"referer", EMPTY_VALUE),
+		"request_protocol": get_protocol(scope),
+		"request_method": scope["method"],
+		"request_path": scope["path"],
+		"request_host": f'{server[0]}:{server[1]}',
+		"request_size": int(content_length) if content_length.isdigit() else 0,
+		"request_content_type": headers.get(b"content-type", EMPTY_VALUE),
+		"request_direction": 'in',
+		"remote_ip": client[0],
+		"remote_port": str(client[1]),
+		"response_status": status_code,
+		"duration": duration,
+	}
+
+
+class LoggingMiddleware:
 	"""
-	def __init__(self, app: FastAPI, debug: bool = False):
-		super().__init__(app)
+	ASGI middleware для журналирования запросов и ответов.
+
+	Логгеры с patch собираются один раз на экземпляр, поля запроса
+	передаются им через contextvar и собираются только если запись
+	действительно будет записана (loguru вызывает patch после проверки
+	уровня). Заголовки пишутся отдельной DEBUG записью только в режиме
+	`debug`. Успешные запросы можно логировать выборочно через
+	`sample_rate`, ошибки пишутся всегда.
+	"""
+
+	def __init__(self, app: ASGIApp, debug: bool = False, sample_rate: float = 1.0) -> None:
+		self.app = app
 		self.debug = debug
+		self.sample_rate = sample_rate
+		self._logger = logger.patch(self._add_fields)
+		self._headers_logger = logger.patch(self._add_headers)
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		start_time = time.perf_counter()
+		status_code = 500
+		exception_object: Optional[Exception] = None
+
+		async def send_wrapper(message: Message) -> None:
+			nonlocal status_code
+			if message["type"] == "http.response.start":
+				status_code = message["status"]
+			await send(message)
 
-	@staticmethod
-	async def get_protocol(request: Request) -> str:
-		protocol = str(request.scope.get('type', ''))
-		http_version = str(request.scope.get('http_version', ''))
-		if protocol.lower() == 'http' and http_version:
-			return f'{protocol.upper()}/{http_version}'
-		return EMPTY_VALUE
-
-	async def dispatch(
-			self, request: Request, call_next: RequestResponseEndpoint,
-	):
-		start_time = time.monotonic()
-		exception_object = None
-
-		server: tuple = request.get('server', ('localhost', PORT))
-		request_headers: dict = dict(request.headers.items())
-		# Response Side
 		try:
-			response = await call_next(request)
+			await self.app(scope, receive, send_wrapper)
 		except Exception as exc:
 			exception_object = exc
-			response = Response(
-				content=orjson.dumps(ErrorResult(message=str(exc), data={'error': str(exc)}))
-			)
-		duration: float = time.monotonic() - start_time
-		temp_duration = str(duration)[:4]
-		duration = float(temp_duration)
-		# Инициализация и формирования полей для запроса-ответа
-		request_json_fields = RequestJsonLogSchema(
-			request_uri=str(request.url),
-			request_referer=request_headers.get('referer', EMPTY_VALUE),
-			request_protocol=await self.get_protocol(request),
-			request_method=request.method,
-			request_path=request.url.path,
-			request_host=f'{server[0]}:{server[1]}',
-			request_size=int(request_headers.get('content-length', 0)),
-			request_content_type=request_headers.get(
-				'content-type', EMPTY_VALUE),
-			request_headers=str(orjson.dumps(request_headers)),
-			request_direction='in',
-			remote_ip=request.client[0],
-			remote_port=str(request.client[1]),
-			duration=duration
-		).dict()
+			raise
+		finally:
+			duration = round(time.perf_counter() - start_time, 4)
+			if exception_object is not None or status_code >= 400 or self._sampled():
+				self._log(scope, status_code, duration, exception_object)
+
+	def _sampled(self) -> bool:
+		return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+	@staticmethod
+	def _add_fields(record: dict) -> None:
+		scope, status_code, duration = _logged_request.get()
+		record["extra"].update(
+			request_json_fields=request_json_fields(scope, status_code, duration),
+			to_mask=True,
+		)
+
+	@staticmethod
+	def _add_headers(record: dict) -> None:
+		scope = _logged_request.get()[0]
+		headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", ())}
+		record["extra"].update(request_headers=orjson.dumps(headers).decode())
+
+	def _log(self, scope: Scope, status_code: int, duration: float, exception_object: Optional[Exception]) -> None:
 		# Хочется на каждый запрос читать
 		# и понимать в сообщении самое главное,
 		# поэтому message мы сразу делаем типовым
+		path = scope["path"]
 		message = (
 			f'{"Error" if exception_object else "Response"} '
-			f'to this request {request.method} \"{str(request.url)}\", '
-			f'in {duration} sec'
-		)
-		logger.info(
-			message,
-			extra={
-				'request_json_fields': request_json_fields,
-				'to_mask': True,
-			},
-			exc_info=exception_object,
+			f'to this request {scope["method"]} "{path}", '
+			f'status {status_code} in {duration} sec'
 		)
-		if exception_object:
-			raise exception_object
-		return response
\ No newline at end of file
+		token = _logged_request.set((scope, status_code, duration))
+		try:
+			if exception_object is not None:
+				self._logger.opt(exception=exception_object).info(message)
+			else:
+				self._logger.info(message)
+			if self.debug:
+				self._headers_logger.debug(f'Headers of {scope["method"]} "{path}"')
+		finally:
+			_logged_request.reset(token)
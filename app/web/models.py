@@ -6,6 +6,7 @@ from typing import Sequence
 
 from attr import define, field
 from sqlalchemy import Column, DateTime, func, Table, String, Boolean, UUID, DECIMAL, BIGINT, Integer, JSON
+from sqlalchemy import Sequence as SqlSequence
 from sqlalchemy.orm import registry
 
 
@@ -52,6 +53,11 @@ class Token(IdEntity):
 		]
 
 
+# id транзакции в сообщении воркеру, воркер по нему отбрасывает повторы,
+# поэтому он берется из последовательности в бд, а не из кеша
+tx_id_sequence = SqlSequence("transactions_tx_id_seq")
+
+
 @entity
 class TransactionEntity(IdEntity):
 	amount: Decimal
@@ -61,6 +67,7 @@ class TransactionEntity(IdEntity):
 	email: str | None = field(default=None)
 	status: TransactionStatus = field(default=TransactionStatus.pending.value)
 	roblox_username: str
+	tx_id: int | None = field(default=None)
 
 	@staticmethod
 	def mapper_args() -> Sequence[Column]:
@@ -74,6 +81,7 @@ class TransactionEntity(IdEntity):
 			Column("status", String, nullable=False, default=TransactionStatus.pending.value),
 			# Статус транзакции
 			Column("roblox_username", String, nullable=False),  # Roblox имя пользователя
+			Column("tx_id", BIGINT, tx_id_sequence, nullable=True, unique=True),  # id для воркера
 		]
 
 
@@ -0,0 +1,56 @@
+"""
+Блокирующие вызовы selenium веб сервиса выполняются в потоках,
+что бы ни один роут не останавливал event loop.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional, TypeVar
+
+from selenium.common import TimeoutException
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.support.wait import WebDriverWait
+
+from app.services.driver import presence_of_any_text_in_element
+
+T = TypeVar("T")
+
+
+class AsyncDriver:
+	"""
+	WebDriver, у которого каждый вызов выполняется в executor.
+
+	Для последовательности из нескольких шагов есть `run`,
+	он выполняет func(driver, ...) целиком в одном потоке.
+	"""
+
+	def __init__(self, driver: WebDriver, executor: Executor) -> None:
+		self.driver = driver
+		self._executor = executor
+
+	async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self._executor, functools.partial(func, self.driver, *args, **kwargs))
+
+	async def get(self, url: str) -> None:
+		await self.run(lambda driver: driver.get(url))
+
+	async def refresh(self) -> None:
+		await self.run(lambda driver: driver.refresh())
+
+	async def request(self, method: str, url: str, **kwargs) -> Any:
+		# seleniumrequests, uses cookies of the browser
+		return await self.run(lambda driver: driver.request(method, url, **kwargs))
+
+	async def wait_for_text(self, locator: tuple[str, str], timeout: float) -> Optional[str]:
+		"""
+		Текст элемента, или None если он не появился за timeout секунд.
+		"""
+		def wait(driver: WebDriver) -> Optional[str]:
+			try:
+				return WebDriverWait(driver, timeout).until(presence_of_any_text_in_element(locator))
+			except TimeoutException:
+				return None
+
+		return await self.run(wait)
+
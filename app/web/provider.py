@@ -5,8 +5,7 @@ import aiohttp
 from aiohttp import CookieJar
 from fastapi import Depends, HTTPException, Request
 from fastapi.params import Header
-from redis.asyncio import Redis
-from seleniumrequests import Firefox
+from redis.asyncio import Redis, BlockingConnectionPool
 from sqlalchemy.ext.asyncio import AsyncSession
 from yarl import URL
 
@@ -14,22 +13,23 @@ from app.providers import get_token_service
 from app.repos import UserTokenRepository
 from app.services.db import get_db_conn
 from app.services.interfaces import BasicDBConnector
+from app.services.queue.publisher import AsyncBatchPublisher
 from app.settings import get_settings
-from app.web.db import setup_engine, sa_session_factory, get_db_session
+from app.web.coalescing import CoalescingClient
+from app.web.driver_pool import WebDriverPool
 from app.web.interfaces import ITokenRepository, ITransactionsRepo
 from app.web.logger import get_logger
+from app.web.roblox import UniverseResolver, GamePassCache
 from app.web.repos import TokenRepository, TransactionRepository, BotTokenRepository, BonusesRepository
-from app.web.websettings import WebSettings, get_web_settings
+from app.web.websettings import WebSettings
 
 
 logger = get_logger(__name__)
 
 
-async def session_provider(settings: WebSettings = Depends(get_web_settings)) -> AsyncSession:
-	engine = setup_engine(settings.db_dsn)
-	session = sa_session_factory(engine)
-
-	sus = session()
+async def session_provider(request: Request) -> AsyncSession:
+	# engine and session factory are created once in the app lifespan
+	sus = request.app.state.session_factory()
 	try:
 		yield sus
 	finally:
@@ -59,21 +59,45 @@ async def get_roblox_token_repo() -> Tuple[UserTokenRepository, BasicDBConnector
 	return token_service, connection
 
 
-async def get_redis() -> Redis:
-	settings = get_web_settings()
-	redis = Redis(host=settings.redis_host, port=settings.redis_port)
-	try:
-		yield redis
-	finally:
-		await redis.close()
+def get_redis(request: Request) -> Redis:
+	# shares one connection pool owned by the app lifespan
+	return request.app.state.redis
+
+
+def create_redis(settings: WebSettings) -> Redis:
+	pool = BlockingConnectionPool(
+		host=settings.redis_host,
+		port=settings.redis_port,
+		db=settings.redis_db,
+		max_connections=settings.redis_max_connections,
+		timeout=settings.redis_pool_timeout,
+		health_check_interval=settings.redis_health_check_interval,
+		socket_timeout=settings.redis_socket_timeout,
+		socket_connect_timeout=settings.redis_socket_connect_timeout,
+	)
+	return Redis(connection_pool=pool)
+
+
+def client_provider(request: Request) -> CoalescingClient:
+	# identical concurrent requests to roblox share one upstream call
+	return request.app.state.roblox_client
+
+
+def driver_pool_provider(request: Request) -> WebDriverPool:
+	return request.app.state.driver_pool
+
+
+def publisher_provider(request: Request) -> AsyncBatchPublisher:
+	# one long-lived connection with publisher confirms, owned by the app lifespan
+	return request.app.state.publisher
 
 
-def client_provider(request: Request) -> aiohttp.ClientSession:
-	return request.app.state.client_session
+def universe_resolver_provider(request: Request) -> UniverseResolver:
+	return request.app.state.universe_resolver
 
 
-def driver_provider(request: Request) -> Firefox:
-	return request.app.state.driver
+def gamepass_cache_provider(request: Request) -> GamePassCache:
+	return request.app.state.gamepass_cache
 
 
 def get_client(token: str) -> aiohttp.ClientSession:
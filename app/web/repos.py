@@ -9,7 +9,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.web.interfaces import ITokenRepository, ITransactionsRepo
-from app.web.models import Token, TransactionEntity, BotToken, Bonuses
+from app.web.models import Token, TransactionEntity, BotToken, Bonuses, tx_id_sequence
 
 
 class TokenRepository(ITokenRepository):
@@ -152,6 +152,9 @@ class TransactionRepository(ITransactionsRepo):
 		await self.db.commit()
 		return entity.id
 
+	async def next_tx_id(self) -> int:
+		return await self.db.scalar(tx_id_sequence.next_value())
+
 	async def get_transactions(self, roblox_name: str) -> Sequence[TransactionEntity]:
 		stmt = select(TransactionEntity).where(TransactionEntity.roblox_username == roblox_name)
 		result = await self.db.execute(stmt)
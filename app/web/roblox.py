@@ -0,0 +1,232 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+from uuid import uuid4
+
+from redis.asyncio import Redis
+
+from app.web.coalescing import CoalescingClient, SingleFlight
+from app.web.logger import get_logger
+
+UNIVERSE_HASH_KEY = "universe_ids"
+DEFAULT_UNIVERSE_CACHE_SIZE = 10000
+GAMEPASSES_KEY = "gamepasses_{universe_id}"
+GAMEPASSES_INDEX_KEY = "gamepasses_index_{universe_id}"
+FETCHED_AT_FIELD = "__fetched_at"
+DEFAULT_GAMEPASS_FRESH_TTL = 30
+DEFAULT_GAMEPASS_STALE_TTL = 600
+OMNI_SEARCH_URL = "https://apis.roblox.com/search-api/omni-search"
+# one id per process, so identical searches are coalesced
+OMNI_SEARCH_SESSION_ID = str(uuid4())
+
+logger = get_logger()
+
+
+class RobloxApiError(Exception):
+	pass
+
+
+class RobloxRateLimited(RobloxApiError):
+	pass
+
+
+def gamepass_index_field(seller_name: str, price: int) -> str:
+	return f"{seller_name}:{price}"
+
+
+def build_gamepass_index(gamepasses: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+	index = {}
+	for gamepass in gamepasses:
+		price = gamepass.get("price")
+		# passes that are not on sale have no price and can't be bought
+		if price is None or price != int(price):
+			continue
+		index.setdefault(gamepass_index_field(gamepass["sellerName"], int(price)), gamepass)
+	return index
+
+
+async def search_players(client: CoalescingClient, player_name: str) -> list[dict[str, Any]]:
+	"""
+	Тот же omni-search, который дергает страница roblox.com/search/users.
+	"""
+	params = {
+		"searchQuery": player_name,
+		"verticalType": "user",
+		"pageType": "all",
+		"sessionId": OMNI_SEARCH_SESSION_ID,
+	}
+	async with client.get(OMNI_SEARCH_URL, params=params) as response:
+		if response.status == 429:
+			raise RobloxRateLimited("No omni-search response")
+		if response.status != 200:
+			raise RobloxApiError(f"Omni-search responded with {response.status}")
+		data = await response.json()
+
+	results = data.get("searchResults") or []
+	return results[0].get("contents") or [] if results else []
+
+
+class UniverseResolver:
+	"""
+	Place id -> universe id, эта связь никогда не меняется.
+
+	Сначала смотрит в LRU процесса, потом в redis hash без TTL,
+	и только потом идет в роблокс. Одновременные запросы одного
+	place id делают один запрос в роблокс.
+	"""
+
+	def __init__(self, redis: Redis, client: CoalescingClient, capacity: int = DEFAULT_UNIVERSE_CACHE_SIZE):
+		self._redis = redis
+		self._client = client
+		self._capacity = capacity
+
+		self._cache: OrderedDict[int, int] = OrderedDict()
+		self._flight = SingleFlight()
+
+	def _remember(self, place_id: int, universe_id: int) -> None:
+		self._cache[place_id] = universe_id
+		self._cache.move_to_end(place_id)
+		if len(self._cache) > self._capacity:
+			self._cache.popitem(last=False)
+
+	async def resolve(self, place_id: int) -> int:
+		return (await self.resolve_many([place_id]))[place_id]
+
+	async def resolve_many(self, place_ids: Iterable[int]) -> dict[int, int]:
+		result: dict[int, int] = {}
+		missing: list[int] = []
+		for place_id in dict.fromkeys(place_ids):
+			universe_id = self._cache.get(place_id)
+			if universe_id is None:
+				missing.append(place_id)
+				continue
+			self._cache.move_to_end(place_id)
+			result[place_id] = universe_id
+
+		if not missing:
+			return result
+
+		upstream: list[int] = []
+		for place_id, value in zip(missing, await self._redis.hmget(UNIVERSE_HASH_KEY, missing)):
+			if value is None:
+				upstream.append(place_id)
+				continue
+			self._remember(place_id, int(value))
+			result[place_id] = int(value)
+
+		if upstream:
+			universe_ids = await asyncio.gather(*(self._fetch(x) for x in upstream))
+			result.update(zip(upstream, universe_ids))
+		return result
+
+	async def _fetch(self, place_id: int) -> int:
+		return await self._flight.do(place_id, lambda: self._fetch_and_store(place_id))
+
+	async def _fetch_and_store(self, place_id: int) -> int:
+		logger.info(f"Resolving universe of place {place_id}")
+
+		url = f"https://apis.roblox.com/universes/v1/places/{place_id}/universe"
+		async with self._client.get(url) as response:
+			if response.status == 429:
+				raise RobloxRateLimited("No universe response")
+			if response.status != 200:
+				raise RobloxApiError(f"Universe responded with {response.status}")
+			universe_id = (await response.json()).get("universeId")
+
+		if universe_id is None:
+			raise RobloxApiError(f"Place {place_id} has no universe")
+
+		await self._redis.hset(UNIVERSE_HASH_KEY, place_id, universe_id)
+		self._remember(place_id, universe_id)
+		return universe_id
+
+
+class GamePassCache:
+	"""
+	Список геймпассов вселенной в redis, stale-while-revalidate.
+
+	Запись свежая `fresh_ttl` секунд, после этого она все еще отдается,
+	но в фоне запускается одно обновление. Через `stale_ttl` redis
+	удаляет запись. `force=True` всегда идет в роблокс, это для покупки.
+
+	Рядом со списком хранится индекс (sellerName, price) -> геймпасс
+	в redis hash, так что `find` это один HMGET.
+	"""
+
+	def __init__(
+			self,
+			redis: Redis,
+			client: CoalescingClient,
+			fresh_ttl: float = DEFAULT_GAMEPASS_FRESH_TTL,
+			stale_ttl: int = DEFAULT_GAMEPASS_STALE_TTL,
+	):
+		self._redis = redis
+		self._client = client
+		self._fresh_ttl = fresh_ttl
+		self._stale_ttl = stale_ttl
+
+		self._flight = SingleFlight()
+
+	async def get(self, universe_id: int, force: bool = False) -> list[dict[str, Any]]:
+		if not force:
+			cached = await self._redis.get(GAMEPASSES_KEY.format(universe_id=universe_id))
+			if cached:
+				entry = json.loads(cached)
+				if time.time() - entry["fetched_at"] > self._fresh_ttl:
+					self._revalidate(universe_id)
+				return entry["data"]
+
+		return await self._flight.do(universe_id, lambda: self._fetch_and_store(universe_id))
+
+	async def find(self, universe_id: int, seller_name: str, price: int, force: bool = False) -> Optional[dict[str, Any]]:
+		field = gamepass_index_field(seller_name, price)
+		if not force:
+			fetched_at, raw = await self._redis.hmget(
+				GAMEPASSES_INDEX_KEY.format(universe_id=universe_id), FETCHED_AT_FIELD, field)
+			if fetched_at is not None:
+				if time.time() - float(fetched_at) > self._fresh_ttl:
+					self._revalidate(universe_id)
+				return json.loads(raw) if raw else None
+
+		gamepasses = await self._flight.do(universe_id, lambda: self._fetch_and_store(universe_id))
+		return build_gamepass_index(gamepasses).get(field)
+
+	def _revalidate(self, universe_id: int) -> None:
+		if universe_id in self._flight:
+			return
+		task = self._flight.spawn(universe_id, lambda: self._fetch_and_store(universe_id))
+		task.add_done_callback(self._on_revalidated)
+
+	@staticmethod
+	def _on_revalidated(task: asyncio.Task) -> None:
+		if not task.cancelled() and task.exception():
+			logger.warning(f"Gamepasses revalidation failed: {task.exception()}")
+
+	async def _fetch_and_store(self, universe_id: int) -> list[dict[str, Any]]:
+		logger.info(f"Fetching gamepasses of universe {universe_id}")
+
+		url = f"https://games.roblox.com/v1/games/{universe_id}/game-passes?limit=100&sortOrder=1"
+		async with self._client.get(url) as response:
+			if response.status == 429:
+				raise RobloxRateLimited("No gamepass response")
+			if response.status != 200:
+				raise RobloxApiError(f"Gamepasses responded with {response.status}")
+			gamepasses = (await response.json())["data"]
+
+		fetched_at = time.time()
+		index = {field: json.dumps(gamepass) for field, gamepass in build_gamepass_index(gamepasses).items()}
+		index[FETCHED_AT_FIELD] = fetched_at
+
+		entry = {"fetched_at": fetched_at, "data": gamepasses}
+		index_key = GAMEPASSES_INDEX_KEY.format(universe_id=universe_id)
+		async with self._redis.pipeline(transaction=True) as pipe:
+			await (
+				pipe.set(GAMEPASSES_KEY.format(universe_id=universe_id), json.dumps(entry), ex=self._stale_ttl)
+				.delete(index_key)
+				.hset(index_key, mapping=index)
+				.expire(index_key, self._stale_ttl)
+				.execute()
+			)
+		return gamepasses
@@ -5,27 +5,31 @@ from datetime import datetime
 from decimal import Decimal
 from typing import Sequence, Annotated, Any
 
-from aiohttp import ClientSession
+from aiohttp import ClientError
 from fastapi import FastAPI, APIRouter, Request, Depends, HTTPException, Body
 from redis.asyncio import Redis
 from requests import Response
-from selenium.common import NoSuchElementException, TimeoutException
+from selenium.common import NoSuchElementException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 
-from app.browser import auth_browser, auth, is_authed
-from app.providers import get_publisher
+from app.browser import auth_browser
 from app.repos import UserTokenRepository
 from app.services.driver import presence_of_any_text_in_element
-from app.services.queue.publisher import BasicMessageSender
+from app.services.queue.publisher import AsyncBatchPublisher, PublishError
 from app.services.validators import validate_game_pass_url
+from app.web.coalescing import CoalescingClient
+from app.web.driver_pool import WebDriverPool
+from app.web.offload import AsyncDriver
 from app.web.consts import MIN_ROBUXES
 from app.web.interfaces import ITokenRepository, ITransactionsRepo
 from app.web.logger import get_logger
 from app.web.models import TransactionEntity, Bonuses
-from app.web.provider import token_repo_provider, get_redis, client_provider, driver_provider, \
-	transaction_repo_provider, get_token, bot_token_repo_provider, bonuses_repo_provider, get_roblox_token_repo
+from app.web.provider import token_repo_provider, get_redis, client_provider, driver_pool_provider, \
+	transaction_repo_provider, get_token, bot_token_repo_provider, bonuses_repo_provider, get_roblox_token_repo, \
+	universe_resolver_provider, gamepass_cache_provider, publisher_provider
 from app.web.repos import BotTokenRepository, BonusesRepository
+from app.web.roblox import UniverseResolver, GamePassCache, RobloxApiError, RobloxRateLimited, search_players
 from app.web.schemas import GamePassInfo, PlayerData, GameInfo, BuyRobuxScheme, TransactionScheme, \
 	RobuxBuyServiceScheme, BuyRobuxesThroghUrl, BotTokenResponse, BotUpdatedRequest, BotTokenAddRequest, \
 	AddBonusRequest, bonus_rewards, FRIEND_ADDED_BONUS, RobuxAmountResponse, ROBUX_TO_RUBLES_COURSE, WithdrawlResponse, \
@@ -90,6 +94,33 @@ def form_users_response(users: list[dict], batch_info: list[dict]) -> list[Playe
 	return result
 
 
+async def resolve_universe(resolver: UniverseResolver, place_id: int) -> int:
+	try:
+		return await resolver.resolve(place_id)
+	except RobloxRateLimited:
+		logger.error("No universe response")
+		raise HTTPException(detail="No unvierse response", status_code=429)
+	except RobloxApiError as e:
+		raise HTTPException(detail=str(e), status_code=404)
+
+
+async def find_gamepass(
+	gamepass_cache: GamePassCache,
+	universe_id: int,
+	seller_name: str,
+	price: int,
+	force: bool = False,
+) -> GamePassInfo | None:
+	try:
+		found = await gamepass_cache.find(universe_id, seller_name, price, force=force)
+	except RobloxRateLimited:
+		logger.error("No gamepass response")
+		raise HTTPException(detail="Rate limit for gamepasses", status_code=429)
+	except RobloxApiError as e:
+		raise HTTPException(detail=str(e), status_code=502)
+	return GamePassInfo(**found) if found else None
+
+
 @router.post("/create-token")
 async def create_token(
 		request: Request,
@@ -107,7 +138,7 @@ async def create_token(
 	}
 
 
-async def search_players_with_timeouts(client: Firefox, player_name: str) -> list[dict] | None:
+def search_players_with_timeouts(client: Firefox, player_name: str) -> list[dict] | None:
 	del client.requests
 
 	client.get(f"https://www.roblox.com/search/users?keyword={player_name}")
@@ -141,8 +172,8 @@ async def search_players_with_timeouts(client: Firefox, player_name: str) -> lis
 async def search_player(
 	player_name: str,
 	redis: Redis = Depends(get_redis),
-	driver_requests: Firefox = Depends(driver_provider),
-	client: ClientSession = Depends(client_provider)
+	drivers: WebDriverPool = Depends(driver_pool_provider),
+	client: CoalescingClient = Depends(client_provider)
 ) -> list[PlayerData] | None:
 	result = await redis.get(f"players_{player_name}")
 
@@ -152,9 +183,16 @@ async def search_player(
 		return [PlayerData(**v) for v in result]
 
 	logger.info("Sending 'search user' request to roblox api")
-	raw_users = await search_players_with_timeouts(driver_requests, player_name)
+	try:
+		raw_users = await search_players(client, player_name)
+	except (RobloxApiError, ClientError) as e:
+		logger.warning(f"Omni-search failed, falling back to browser: {e}")
+		async with drivers.lease() as driver:
+			raw_users = await driver.run(search_players_with_timeouts, player_name)
 	if raw_users is None:
 		raise HTTPException(detail="Too many requests", status_code=429)
+	if not raw_users:
+		return []
 
 	batch_response = await client.post("https://thumbnails.roblox.com/v1/batch", json=form_users_batch_request(raw_users))
 	if batch_response.status == 429:
@@ -164,8 +202,7 @@ async def search_player(
 	users = form_users_response(raw_users, _data["data"])
 
 	logger.info(f"lset is placed in players_{player_name}")
-	await redis.set(f"players_{player_name}", json.dumps([x.dict() for x in users]))
-	await redis.expire(f"players_{player_name}", 3600)
+	await redis.set(f"players_{player_name}", json.dumps([x.dict() for x in users]), ex=3600)
 
 	return users
 
@@ -173,44 +210,26 @@ async def search_player(
 @router.get("/search/{game_id}/gamepass")
 async def search_gamepass_by_id(
 	game_id: int,
-	redis: Redis = Depends(get_redis),
-	client: ClientSession = Depends(client_provider)
+	resolver: UniverseResolver = Depends(universe_resolver_provider),
+	gamepass_cache: GamePassCache = Depends(gamepass_cache_provider),
 ) -> list[GamePassInfo] | None:
-	result = await redis.get(f"game_{game_id}")
-
-	if result:
-		logger.info("Found from redis cache")
-		result = json.loads(result)
-		return [GamePassInfo(**v) for v in result]
-	logger.info("Sending 'search by gamepasses' request to roblox api")
-
-	universe_response = await client.get(f"https://apis.roblox.com/universes/v1/places/{game_id}/universe")
-	if universe_response.status == 429:
-		logger.error("No universe response")
-		return
-
-	_data = await universe_response.json()
-
-	universe_id = _data["universeId"]
-	response = await client.get(f"https://games.roblox.com/v1/games/{universe_id}/game-passes?limit=100&sortOrder=1")
-	if response.status == 429:
-		logger.error("No gamepass response")
+	try:
+		universe_id = await resolver.resolve(game_id)
+		gamepasses = await gamepass_cache.get(universe_id)
+	except RobloxRateLimited as e:
+		logger.error(str(e))
 		return
+	except RobloxApiError as e:
+		raise HTTPException(detail=str(e), status_code=404)
 
-	gamepasses: list[dict] = (await response.json())['data']
-	data = [GamePassInfo(**v) for v in gamepasses]
-
-	logger.info(f"Lset to game_{game_id}")
-	await redis.set(f"game_{game_id}", json.dumps(gamepasses))
-
-	return data
+	return [GamePassInfo(**v) for v in gamepasses]
 
 
 @router.get("/search/games")
 async def search_game(
 	player_id: int,
 	redis: Redis = Depends(get_redis),
-	client: ClientSession = Depends(client_provider)
+	client: CoalescingClient = Depends(client_provider)
 ) -> list[GameInfo]:
 	logger.info(f"Player id: {player_id}")
 	player_games = await redis.get(f"player_game_{player_id}")
@@ -246,20 +265,45 @@ async def search_game(
 
 	logger.info(f"Lset to player_game_{player_id}")
 	logger.info(f"Player games: {player_games}")
-	await redis.set(f"player_game_{player_id}", json.dumps([x.dict() for x in player_games]))
-	await redis.expire(f"player_game_{player_id}", 360)
+	await redis.set(f"player_game_{player_id}", json.dumps([x.dict() for x in player_games]), ex=360)
 
 	return player_games
 
 
+async def is_gamepass_owned(driver: AsyncDriver, gamepass_id: int) -> bool:
+	url = f"https://www.roblox.com/game-pass/{gamepass_id}/"
+	logger.info(f"Redirecting bot to link: {url}")
+	await driver.get(url)
+	return await driver.wait_for_text((By.CSS_SELECTOR, ".inventory-button"), 3) is not None
+
+
+async def publish_purchase(publisher: AsyncBatchPublisher, message: RobuxBuyServiceScheme) -> None:
+	logger.info(f"Message to bot service: {message}")
+	try:
+		await publisher.publish(message.dict())
+	except PublishError as e:
+		# the broker is down or slow, the client may try again later
+		logger.error(f"Message to bot service was not confirmed: {e}")
+		raise HTTPException(detail="Purchase service is unavailable", status_code=503)
+
+
+def get_bot_user_id(driver: Firefox) -> str:
+	_temp = driver.find_element(By.CSS_SELECTOR, "a.text-link.dynamic-overflow-container")
+	link = _temp.get_attribute("href")
+	parts = link.split("/")
+	logger.info(f"Parts: {parts}")
+	return parts[4]
+
+
 @router.post("/buy_robux", response_model=TransactionScheme)
 async def buy_robux(
 	data: BuyRobuxScheme,
 	redis: Redis = Depends(get_redis),
-	client: ClientSession = Depends(client_provider),
-	publisher: BasicMessageSender = Depends(get_publisher),
+	resolver: UniverseResolver = Depends(universe_resolver_provider),
+	gamepass_cache: GamePassCache = Depends(gamepass_cache_provider),
+	publisher: AsyncBatchPublisher = Depends(publisher_provider),
 	transaction_repo: ITransactionsRepo = Depends(transaction_repo_provider),
-	requests_driver: Firefox = Depends(driver_provider),
+	drivers: WebDriverPool = Depends(driver_pool_provider),
 	bonuses_repo: BonusesRepository = Depends(bonuses_repo_provider),
 ) -> TransactionScheme | None:
 	ok = await redis.get(f"withdrawl_{data.bonus_withdrawal_id}_{data.roblox_username}")
@@ -268,55 +312,21 @@ async def buy_robux(
 			raise HTTPException(detail="Need to be highed, and has to have withdrawl id", status_code=400)
 
 	logger.info(f"SEarching in place: {data.game_id}")
-	universe_response = await client.get(f"https://apis.roblox.com/universes/v1/places/{data.game_id}/universe")
-	if universe_response.status == 429:
-		logger.error("No universe response")
-		raise HTTPException(detail="No unvierse response", status_code=429)
-
-	_data = await universe_response.json()
-
-	logger.info(f"Universe find... {_data}")
-
-	universe_id = _data["universeId"]
-	response = await client.get(
-		f"https://games.roblox.com/v1/games/{universe_id}/game-passes?limit=100&sortOrder=1")
-
-	if response.status == 429:
-		logger.error("No gamepass response")
-		raise HTTPException(detail="Rate limit for gamepasses", status_code=429)
-
-	json_response = await response.json()
-
-	logger.info(f"Raw response: {json_response}")
-	_temp: list[dict] = json_response['data']
-	gamepasses = [GamePassInfo(**v) for v in _temp]
-
-	logger.info(f"Lset to game_{data.game_id}")
-	logger.info(f'Gamepasses: {_temp}')
+	universe_id = await resolve_universe(resolver, data.game_id)
+	logger.info(f"Universe find... {universe_id}")
 
 	real_gamepass_price = round(int(data.robux_amount) * 1.429)
-	logger.info(f"Real gamepass price: {real_gamepass_price}, gamepasses of user: {gamepasses}")
-	found_gamepass: GamePassInfo | None = None
-	for game_pass in gamepasses:
-		if game_pass.price == real_gamepass_price and game_pass.sellerName == data.roblox_username:
-			found_gamepass = game_pass
+	logger.info(f"Real gamepass price: {real_gamepass_price}")
+	# the final purchase step always revalidates the listing
+	found_gamepass = await find_gamepass(
+		gamepass_cache, universe_id, data.roblox_username, real_gamepass_price, force=True)
 
 	if not found_gamepass:
 		raise HTTPException(detail="Not found gamepasses with that amount", status_code=402)
 
-	message = RobuxBuyServiceScheme(
-			url=f"https://www.roblox.com/game-pass/{found_gamepass.id}/",
-			tx_id=1,
-			price=real_gamepass_price,
-		)
-
-	try:
-		WebDriverWait(requests_driver, 3).until(
-			presence_of_any_text_in_element((By.CSS_SELECTOR, ".inventory-button"))
-		)
-	except TimeoutException:
-		pass
-	else:
+	async with drivers.lease() as driver:
+		owned = await is_gamepass_owned(driver, found_gamepass.id)
+	if owned:
 		raise HTTPException(detail="Gamepass is already bought, create new one", status_code=409)
 
 	entity = TransactionEntity(
@@ -326,13 +336,19 @@ async def buy_robux(
 		gamepass_id=found_gamepass.id,
 		email=data.email,
 		roblox_username=data.roblox_username,
+		tx_id=await transaction_repo.next_tx_id(),
 	)
 
 	await transaction_repo.add_transaction(entity)
 
+	message = RobuxBuyServiceScheme(
+			url=f"https://www.roblox.com/game-pass/{found_gamepass.id}/",
+			tx_id=entity.tx_id,
+			price=real_gamepass_price,
+		)
+
 	logger.info(f"Sending transaction!!!!!, found gamepass: {found_gamepass}")
-	logger.info(f"Message to bot service: {message}")
-	publisher.send_message(message.dict())
+	await publish_purchase(publisher, message)
 	logger.info("WAITING")
 
 	tx = TransactionScheme(
@@ -359,87 +375,54 @@ async def buy_robux(
 @router.post("/buy_robux/check")
 async def buy_robux_check(
 	data: BuyRobuxScheme,
-	client: ClientSession = Depends(client_provider),
-	requests_driver: Firefox = Depends(driver_provider)
+	resolver: UniverseResolver = Depends(universe_resolver_provider),
+	gamepass_cache: GamePassCache = Depends(gamepass_cache_provider),
+	drivers: WebDriverPool = Depends(driver_pool_provider),
 ) -> bool:
 
 	logger.info(f"SEarching in place: {data.game_id}")
-	universe_response = await client.get(f"https://apis.roblox.com/universes/v1/places/{data.game_id}/universe")
-	if universe_response.status == 429:
-		logger.error("No universe response")
-		raise HTTPException(detail="No unvierse response", status_code=429)
-
-	_data = await universe_response.json()
-
-	logger.info(f"Universe find... {_data}")
-
-	universe_id = _data["universeId"]
-	response = await client.get(
-		f"https://games.roblox.com/v1/games/{universe_id}/game-passes?limit=100&sortOrder=1")
-
-	if response.status == 429:
-		logger.error("No gamepass response")
-		raise HTTPException(detail="Rate limit for gamepasses", status_code=429)
-
-	json_response = await response.json()
-
-	logger.info(f"Raw response: {json_response}")
-	_temp: list[dict] = json_response['data']
-	gamepasses = [GamePassInfo(**v) for v in _temp]
-
-	logger.info(f'Gamepasses: {_temp}')
+	universe_id = await resolve_universe(resolver, data.game_id)
+	logger.info(f"Universe find... {universe_id}")
 
 	real_gamepass_price = round(int(data.robux_amount) * 1.429)
-	logger.info(f"Real gamepass price: {real_gamepass_price}, gamepasses of user: {gamepasses}")
-	found_gamepass: GamePassInfo | None = None
-	for game_pass in gamepasses:
-		if game_pass.price == real_gamepass_price and game_pass.sellerName == data.roblox_username:
-			found_gamepass = game_pass
+	logger.info(f"Real gamepass price: {real_gamepass_price}")
+	found_gamepass = await find_gamepass(gamepass_cache, universe_id, data.roblox_username, real_gamepass_price)
 
 	if not found_gamepass:
 		raise HTTPException(detail="Not found gamepasses with that amount", status_code=402)
 
-	requests_driver.get(f"https://www.roblox.com/game-pass/{found_gamepass.id}/")
-	logger.info(f"Redirecting bot to link: https://www.roblox.com/game-pass/{found_gamepass.id}/")
-	try:
-		WebDriverWait(requests_driver, 3).until(
-			presence_of_any_text_in_element((By.CSS_SELECTOR, ".inventory-button"))
-		)
-	except TimeoutException:
+	async with drivers.lease() as driver:
+		owned = await is_gamepass_owned(driver, found_gamepass.id)
+	if not owned:
 		logger.info("Oh yes!!")
-		return True
-
-	return False
+	return not owned
 
 
 @router.get("/robux_amount_and_course")
 async def robux_amount(
 	redis: Redis = Depends(get_redis),
-	driver_requests: Firefox = Depends(driver_provider),
+	drivers: WebDriverPool = Depends(driver_pool_provider),
 ) -> RobuxAmountResponse:
 	logger.info('Getting player id')
-	_temp = driver_requests.find_element(By.CSS_SELECTOR, "a.text-link.dynamic-overflow-container")
-	link = _temp.get_attribute("href")
-	parts = link.split("/")
-	logger.info(f"Parts: {parts}")
-	user_id = bytes(parts[4], 'utf8')
-	key = f"bot_current_amount_{user_id}"
-	response = await redis.get(key)
-	if response:
-		return RobuxAmountResponse(instock=int(response), course=ROBUX_TO_RUBLES_COURSE)
-
-	url = f"https://economy.roblox.com/v1/users/{user_id.decode('utf8')}/currency"
-
-	logger.info(f"Sending request, url: {url}")
-	response = driver_requests.request("GET", url)
+	# id and currency must come from the same browser, i.e. the same account
+	async with drivers.lease() as driver:
+		user_id = bytes(await driver.run(get_bot_user_id), 'utf8')
+		key = f"bot_current_amount_{user_id}"
+		response = await redis.get(key)
+		if response:
+			return RobuxAmountResponse(instock=int(response), course=ROBUX_TO_RUBLES_COURSE)
+
+		url = f"https://economy.roblox.com/v1/users/{user_id.decode('utf8')}/currency"
+
+		logger.info(f"Sending request, url: {url}")
+		response = await driver.request("GET", url)
 	logger.info(f"Response of currency getter: {response.text}")
 	if response.status_code != 200:
 		raise HTTPException(detail="Cannot get robux amount", status_code=response.status_code)
 	robux = response.json()['robux']
 	logger.info(f"Robux amount: {robux}")
 
-	await redis.set(key, robux)
-	await redis.expire(key, 360)
+	await redis.set(key, robux, ex=360)
 
 	return RobuxAmountResponse(instock=robux, course=ROBUX_TO_RUBLES_COURSE)
 
@@ -447,18 +430,17 @@ async def robux_amount(
 @router.post("/buy_robux/url")
 async def buy_robux_by_url(
 	data: BuyRobuxesThroghUrl,
-	publisher: BasicMessageSender = Depends(get_publisher)
+	publisher: AsyncBatchPublisher = Depends(publisher_provider),
+	transaction_repo: ITransactionsRepo = Depends(transaction_repo_provider),
 ) -> TransactionScheme | None:
 	if not validate_game_pass_url(data.url):
 		raise HTTPException(status_code=400, detail="Не правильный url")
 	logger.info("Sending transaction!!!!!")
-	publisher.send_message(
-		RobuxBuyServiceScheme(
-			url=data.url,
-			tx_id=1,
-			price=data.amount,
-		).dict()
-	)
+	await publish_purchase(publisher, RobuxBuyServiceScheme(
+		url=data.url,
+		tx_id=await transaction_repo.next_tx_id(),
+		price=data.amount,
+	))
 	logger.info("WAITING")
 	return TransactionScheme(
 		id=random.randint(0, 10) + random.randint(0, 100),
@@ -486,7 +468,7 @@ async def update_bot(
 	bot_update_form: BotUpdatedRequest,
 	token: str = Depends(get_token),
 	token_repo: BotTokenRepository = Depends(bot_token_repo_provider),
-	driver_requests: Firefox = Depends(driver_provider),
+	drivers: WebDriverPool = Depends(driver_pool_provider),
 	user_token_repo: UserTokenRepository = Depends(bot_token_repo_provider)
 ) -> BotTokenResponse | None:
 	if val := await token_repo.get_by_token(bot_update_form.token):
@@ -494,8 +476,9 @@ async def update_bot(
 			raise HTTPException(detail="You gave same token!!", status_code=409)
 	if not bot_update_form.token.startswith(START_PREFIX):
 		raise HTTPException(detail="Start prefix is incorrect", status_code=400)
-	auth(driver_requests, bot_update_form.token)
-	if not is_authed(driver_requests):
+	async with drivers.lease() as driver:
+		authed = await driver.authenticate(bot_update_form.token)
+	if not authed:
 		await user_token_repo.mark_as_inactive(bot_update_form.token)
 		raise HTTPException(status_code=409, detail="Selected token does not work")
 
@@ -543,16 +526,19 @@ async def select_bot(
 	body: SelectBotRequest,
 	token_repo: BotTokenRepository = Depends(bot_token_repo_provider),
 	user_token_repo: UserTokenRepository = Depends(get_roblox_token_repo),
-	driver_requests: Firefox = Depends(driver_provider),
+	drivers: WebDriverPool = Depends(driver_pool_provider),
 ) -> BotTokenResponse:
 	bot_token, err = await token_repo.select_bot(body.bot_id)
 	if err:
 		raise HTTPException(status_code=400, detail=err)
 
-	auth(driver_requests, bot_token.token)
-	if not is_authed(driver_requests):
+	async with drivers.lease() as driver:
+		authed = await driver.authenticate(bot_token.token)
+	if not authed:
 		await user_token_repo.mark_as_inactive(bot_token.token)
 		raise HTTPException(status_code=409, detail="Selected token does not work")
+	# the rest of the drivers switch to this bot on their next lease
+	drivers.select_token(bot_token.token)
 
 	return BotTokenResponse.from_orm(bot_token)
 
@@ -612,8 +598,7 @@ async def activate_coupon(
 @router.post("/activate_bonus_withdraw")
 async def activate_bonus_withdraw(body: ActivateBonusWithdrawRequest, redis: Redis = Depends(get_redis)) -> WithdrawlResponse:
 	withdraw_id = random.randint(0, 100000)
-	await redis.set(f"withdrawl_{withdraw_id}_{body.roblox_name}", 'true')
-	await redis.expire(f"withdrawl_{withdraw_id}_{body.roblox_name}", 300)
+	await redis.set(f"withdrawl_{withdraw_id}_{body.roblox_name}", 'true', ex=300)
 
 	return WithdrawlResponse(withdraw_id=withdraw_id)
 
@@ -631,3 +616,13 @@ _start_time = datetime.now()
 @router.get("/heartbeat")
 async def heartbeat():
 	return {"uptime": datetime.now() - _start_time, "ok": True}
+
+
+@router.get("/stats/roblox")
+async def roblox_stats(client: CoalescingClient = Depends(client_provider)) -> dict[str, int]:
+	return client.stats()
+
+
+@router.get("/stats/publisher")
+async def publisher_stats(publisher: AsyncBatchPublisher = Depends(publisher_provider)) -> dict[str, float]:
+	return publisher.stats()
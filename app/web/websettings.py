@@ -8,9 +8,30 @@ class WebSettings(BaseSettings):
 	debug: bool = True
 	web_debug: bool = True
 	log_path: str = "logs/log_{time}.log"
+	log_sample_rate: float = 1.0  # доля успешных запросов попадающих в лог, ошибки пишутся всегда
+
+	db_pool_size: int = 20
+	db_max_overflow: int = 10
+	db_pool_recycle: int = 1800
+	db_pool_timeout: int = 30
 
 	redis_host: str = "localhost"
 	redis_port: int = 6379
+	redis_db: int = 0
+	redis_max_connections: int = 50
+	redis_pool_timeout: float = 5
+	redis_health_check_interval: int = 30
+	redis_socket_timeout: float = 5
+	redis_socket_connect_timeout: float = 2
+
+	web_drivers_count: int = 2
+
+	universe_cache_size: int = 10000
+	gamepass_fresh_ttl: float = 30
+	gamepass_stale_ttl: int = 600
+
+	# запросы в *.roblox.com идут сюда, например на bench.fake_roblox
+	roblox_upstream_url: str = ""
 
 	class Config:
 		validate_assignment = True
@@ -0,0 +1,94 @@
+"""
+Measures DriverPool throughput and fairness with fake drivers.
+
+    python -m bench.driver_pool --drivers 4 --workers 8 --messages 2000 --delay 0.002
+"""
+import argparse
+import statistics
+import threading
+import time
+from collections import Counter
+
+from app.services.driver_pool import DriverPool
+from bench.fakes import FakeDriver
+
+
+def run(drivers: int, workers: int, messages: int, delay: float, max_uses: int, crash_after: int | None) -> dict:
+    created: list[FakeDriver] = []
+
+    def factory() -> FakeDriver:
+        driver = FakeDriver(delay=delay, crash_after=crash_after)
+        created.append(driver)
+        return driver
+
+    pool = DriverPool(factory, size=drivers, max_uses=max_uses)
+    pool.start()
+
+    per_worker = Counter()
+    waits: list[float] = []
+    lock = threading.Lock()
+    remaining = iter(range(messages))
+
+    def worker(n: int) -> None:
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            waited = 0.0
+            try:
+                with pool.lease() as driver:
+                    waited = time.perf_counter() - started
+                    driver.get("https://www.roblox.com/game-pass/1/")
+            except Exception:
+                pass
+            with lock:
+                waits.append(waited)
+                per_worker[n] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    pool.close()
+
+    handled = list(per_worker.values())
+    # Jain's fairness index: 1.0 means every worker got the same share
+    fairness = sum(handled) ** 2 / (len(handled) * sum(x * x for x in handled))
+    uses = [driver.navigations for driver in created]
+    driver_fairness = sum(uses) ** 2 / (len(uses) * sum(x * x for x in uses))
+    waits.sort()
+
+    return {
+        "messages": messages,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(messages / elapsed, 1),
+        "fairness": round(fairness, 4),
+        "driver_fairness": round(driver_fairness, 4),
+        "wait_p50_ms": round(statistics.median(waits) * 1000, 3),
+        "wait_p99_ms": round(waits[int(len(waits) * 0.99) - 1] * 1000, 3),
+        "drivers_created": len(created),
+        **pool.stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--drivers", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--delay", type=float, default=0.002)
+    parser.add_argument("--max-uses", type=int, default=50)
+    parser.add_argument("--crash-after", type=int, default=None)
+    args = parser.parse_args()
+
+    result = run(args.drivers, args.workers, args.messages, args.delay, args.max_uses, args.crash_after)
+    for key, value in result.items():
+        print(f"{key:>16}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Local fake of the Roblox HTTP apis.
+
+Every roblox subdomain is served under its own prefix, so
+https://economy.roblox.com/v1/... becomes {base}/economy/v1/...
+
+    python -m bench.fake_roblox --port 8081
+"""
+import argparse
+import asyncio
+import itertools
+import secrets
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+CSRF_HEADER = "x-csrf-token"
+UNIVERSE_OFFSET = 1000
+DEFAULT_UNIVERSE_ID = 1 + UNIVERSE_OFFSET
+SEARCH_RESULTS = 10
+
+
+@dataclass
+class FakeGamePass:
+    id: int
+    price: int
+    product_id: int
+    seller_id: int = 1
+    seller_name: str = "seller"
+    name: str = "Pass"
+    universe_id: int = DEFAULT_UNIVERSE_ID
+
+    def dict(self, owned: bool = False) -> dict:
+        # as games.roblox.com/v1/games/{universe_id}/game-passes returns it
+        return {
+            "id": self.id,
+            "name": self.name,
+            "displayName": self.name,
+            "productId": self.product_id,
+            "price": self.price,
+            "sellerName": self.seller_name,
+            "sellerId": self.seller_id,
+            "isOwned": owned,
+        }
+
+
+@dataclass
+class FakeRobloxState:
+    balance: int = 10 ** 9
+    latency: float = 0.0
+    game_passes: dict = field(default_factory=dict)
+    owned: set = field(default_factory=set)
+    csrf_token: str = field(default_factory=lambda: secrets.token_hex(8))
+    calls: dict = field(default_factory=dict)
+
+    def add_game_pass(self, game_pass: FakeGamePass) -> None:
+        self.game_passes[game_pass.id] = game_pass
+
+
+_product_ids = itertools.count(1000)
+
+
+def populate(
+        state: FakeRobloxState,
+        count: int = 100,
+        price: int = 10,
+        universe_id: int = DEFAULT_UNIVERSE_ID,
+) -> None:
+    start = max(state.game_passes, default=0) + 1
+    for n in range(start, start + count):
+        state.add_game_pass(FakeGamePass(
+            id=n, price=price + n - start + 1, product_id=next(_product_ids), universe_id=universe_id))
+
+
+def _state(request: web.Request) -> FakeRobloxState:
+    return request.app["state"]
+
+
+@web.middleware
+async def latency_middleware(request: web.Request, handler):
+    state = _state(request)
+    state.calls[request.path] = state.calls.get(request.path, 0) + 1
+    if state.latency:
+        await asyncio.sleep(state.latency)
+    return await handler(request)
+
+
+async def product_info(request: web.Request) -> web.Response:
+    game_pass = _state(request).game_passes.get(int(request.match_info["id"]))
+    if game_pass is None:
+        return web.json_response({"errors": [{"code": 1}]}, status=404)
+    return web.json_response({
+        "TargetId": game_pass.id,
+        "ProductType": "Game Pass",
+        "ProductId": game_pass.product_id,
+        "Name": game_pass.name,
+        "Creator": {"Id": game_pass.seller_id, "Name": game_pass.seller_name, "CreatorType": "User"},
+        "PriceInRobux": game_pass.price,
+        "IsForSale": True,
+    })
+
+
+async def currency(request: web.Request) -> web.Response:
+    return web.json_response({"robux": _state(request).balance})
+
+
+async def authenticated(request: web.Request) -> web.Response:
+    return web.json_response({"id": 1, "name": "bot", "displayName": "bot"})
+
+
+async def place_universe(request: web.Request) -> web.Response:
+    # every place is the root place of its own universe
+    return web.json_response({"universeId": int(request.match_info["place_id"]) + UNIVERSE_OFFSET})
+
+
+async def universe_game_passes(request: web.Request) -> web.Response:
+    state = _state(request)
+    universe_id = int(request.match_info["universe_id"])
+    data = [x.dict(x.id in state.owned) for x in state.game_passes.values() if x.universe_id == universe_id]
+    return web.json_response({"previousPageCursor": None, "nextPageCursor": None, "data": data})
+
+
+async def user_games(request: web.Request) -> web.Response:
+    user_id = int(request.match_info["user_id"])
+    data = [
+        {
+            "id": user_id * 10 + n + UNIVERSE_OFFSET,
+            "name": f"Game {n}",
+            "rootPlace": {"id": user_id * 10 + n, "type": "Place"},
+        }
+        for n in range(3)
+    ]
+    return web.json_response({"previousPageCursor": None, "nextPageCursor": None, "data": data})
+
+
+async def thumbnails_batch(request: web.Request) -> web.Response:
+    body = await request.json()
+    data = [
+        {
+            "requestId": item.get("requestId"),
+            "errorCode": 0,
+            "targetId": item["targetId"],
+            "state": "Completed",
+            "imageUrl": f"https://tr.rbxcdn.com/{item['targetId']}/{item.get('size', '150x150')}/Image/Webp",
+        }
+        for item in body
+    ]
+    return web.json_response({"data": data})
+
+
+async def omni_search(request: web.Request) -> web.Response:
+    query = request.query.get("searchQuery", "")
+    contents = [
+        {"contentType": "User", "contentId": 100 + n, "username": f"{query}{n}", "displayName": f"{query} {n}"}
+        for n in range(SEARCH_RESULTS)
+    ]
+    return web.json_response({"searchResults": [{"contentGroupType": "User", "contents": contents}]})
+
+
+async def logout(request: web.Request) -> web.Response:
+    return web.json_response({}, status=403, headers={CSRF_HEADER: _state(request).csrf_token})
+
+
+async def purchase(request: web.Request) -> web.Response:
+    state = _state(request)
+    if request.headers.get(CSRF_HEADER) != state.csrf_token:
+        return web.json_response({}, status=403, headers={CSRF_HEADER: state.csrf_token})
+
+    product_id = int(request.match_info["product_id"])
+    body = await request.json()
+    game_pass = next((x for x in state.game_passes.values() if x.product_id == product_id), None)
+    if game_pass is None:
+        return web.json_response({"purchased": False, "reason": "NotForSale"})
+    if game_pass.price != body.get("expectedPrice"):
+        return web.json_response({"purchased": False, "reason": "PriceChanged"})
+    if game_pass.id in state.owned:
+        return web.json_response({"purchased": False, "reason": "AlreadyOwned"})
+    if game_pass.price > state.balance:
+        return web.json_response({"purchased": False, "reason": "InsufficientFunds"})
+
+    state.balance -= game_pass.price
+    state.owned.add(game_pass.id)
+    return web.json_response({
+        "purchased": True,
+        "reason": "Success",
+        "productId": product_id,
+        "price": game_pass.price,
+        "balanceAfterSale": state.balance,
+    })
+
+
+def create_app(state: FakeRobloxState | None = None) -> web.Application:
+    app = web.Application(middlewares=[latency_middleware])
+    app["state"] = state or FakeRobloxState()
+
+    app.router.add_get("/economy/v1/game-pass/{id}/game-pass-product-info", product_info)
+    app.router.add_post("/economy/v1/purchases/products/{product_id}", purchase)
+    app.router.add_get("/economy/v1/users/{user_id}/currency", currency)
+    app.router.add_post("/auth/v2/logout", logout)
+    app.router.add_get("/users/v1/users/authenticated", authenticated)
+    app.router.add_get("/apis/universes/v1/places/{place_id}/universe", place_universe)
+    app.router.add_get("/apis/search-api/omni-search", omni_search)
+    app.router.add_get("/games/v1/games/{universe_id}/game-passes", universe_game_passes)
+    app.router.add_get("/games/v2/users/{user_id}/games", user_games)
+    app.router.add_post("/thumbnails/v1/batch", thumbnails_batch)
+    return app
+
+
+async def start(state: FakeRobloxState, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(create_app(state), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    state = FakeRobloxState(latency=args.latency)
+    populate(state)
+    web.run_app(create_app(state), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Test doubles used by benchmark scripts, they let us measure
+throughput of the services without a real browser or broker.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from selenium.common import NoSuchElementException, WebDriverException
+
+_ids = itertools.count(1)
+
+
+class FakeDriver:
+    """
+    Imitates the part of selenium WebDriver used by the app.
+    Every navigation sleeps for `delay` seconds, after `crash_after`
+    navigations the driver starts failing like a dead browser process.
+    Elements are found only for locator values present in `texts`.
+    """
+
+    def __init__(
+            self,
+            delay: float = 0.0,
+            crash_after: Optional[int] = None,
+            texts: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.id = next(_ids)
+        self.delay = delay
+        self.crash_after = crash_after
+        self.texts = texts or {}
+
+        self.navigations = 0
+        self.quitted = False
+        self._url = "about:blank"
+        self._cookies: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _check(self) -> None:
+        if self.quitted:
+            raise WebDriverException("Driver has been quitted")
+        if self.crash_after is not None and self.navigations >= self.crash_after:
+            raise WebDriverException("Browser process is dead")
+
+    @property
+    def current_url(self) -> str:
+        self._check()
+        return self._url
+
+    def get(self, url: str) -> None:
+        self._check()
+        with self._lock:
+            self.navigations += 1
+        if self.delay:
+            time.sleep(self.delay)
+        self._url = url
+
+    def refresh(self) -> None:
+        self.get(self._url)
+
+    def add_cookie(self, cookie: Dict[str, Any]) -> None:
+        self._cookies[cookie["name"]] = cookie
+
+    def get_cookie(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._cookies.get(name)
+
+    def get_cookies(self) -> List[Dict[str, Any]]:
+        return list(self._cookies.values())
+
+    def delete_cookie(self, name: str) -> None:
+        self._cookies.pop(name, None)
+
+    def find_element(self, by: str, value: str) -> Any:
+        # other elements are missing, so waits on them run until their timeout
+        self._check()
+        if value in self.texts:
+            return FakeElement(self.texts[value])
+        raise NoSuchElementException(f"No element {value}")
+
+    def save_screenshot(self, filename: str) -> bool:
+        return True
+
+    def quit(self) -> None:
+        self.quitted = True
+
+    close = quit
+
+
+class FakeElement:
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+    def get_attribute(self, name: str) -> Optional[str]:
+        return None
+
+    def click(self) -> None:
+        pass
+
+
+class FakeMessageSender:
+    """
+    Imitates BasicMessageSender, every publish blocks for `delay` seconds.
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.messages: List[Dict[str, Any]] = []
+        self.closed = False
+
+    def send_message(self, body: Dict[str, Any], headers: Any = None, **kwargs) -> None:
+        if self.delay:
+            time.sleep(self.delay)
+        self.messages.append(body)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeAsyncPublisher:
+    """
+    Imitates AsyncBatchPublisher, every publish is confirmed after `delay` seconds.
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.messages: List[Dict[str, Any]] = []
+        self.closed = False
+
+    async def start(self) -> None:
+        pass
+
+    def send_message(self, body: Dict[str, Any], headers: Any = None, **kwargs) -> None:
+        self.messages.append(body)
+
+    async def publish(self, body: Dict[str, Any], headers: Any = None, **kwargs) -> None:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.messages.append(body)
+
+    def stats(self) -> Dict[str, float]:
+        return {"published": len(self.messages), "confirmed": len(self.messages)}
+
+    async def close(self, timeout: float = 5) -> None:
+        self.closed = True
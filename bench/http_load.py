@@ -0,0 +1,134 @@
+"""
+Small HTTP load generator, reports latency percentiles and RPS.
+
+    python -m bench.http_load http://localhost:8000/api/bonuses/player1 -c 20 -n 2000
+
+Run it once on the commit before a change and once after it,
+`--output` writes the result together with the git commit for comparison.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Any, Optional
+
+from aiohttp import ClientSession, ClientTimeout
+
+
+@dataclass
+class LoadResult:
+    name: str
+    requests: int
+    concurrency: int
+    elapsed: float
+    rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    statuses: dict = field(default_factory=dict)
+    errors: int = 0
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_load(
+        url: str,
+        requests: int,
+        concurrency: int,
+        method: str = "GET",
+        body: Optional[Any] = None,
+        name: Optional[str] = None,
+        session: Optional[ClientSession] = None,
+) -> LoadResult:
+    own_session = session is None
+    if own_session:
+        session = ClientSession(timeout=ClientTimeout(total=60))
+
+    timings: list[float] = []
+    statuses: dict[int, int] = {}
+    errors = 0
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, json=body) as resp:
+                    await resp.read()
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            except Exception:
+                errors += 1
+                continue
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        if own_session:
+            await session.close()
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return LoadResult(
+        name=name or f"{method} {url}",
+        requests=requests,
+        concurrency=concurrency,
+        elapsed=round(elapsed, 3),
+        rps=round(len(timings) / elapsed, 1) if elapsed else 0.0,
+        p50_ms=round(percentile(timings, 0.50) * 1000, 2),
+        p95_ms=round(percentile(timings, 0.95) * 1000, 2),
+        p99_ms=round(percentile(timings, 0.99) * 1000, 2),
+        max_ms=round(timings[-1] * 1000, 2) if timings else 0.0,
+        statuses=statuses,
+        errors=errors,
+    )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results: list[LoadResult]) -> None:
+    print(f"{'name':<40} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}  statuses")
+    for r in results:
+        print(f"{r.name[:40]:<40} {r.rps:>8} {r.p50_ms:>8} {r.p95_ms:>8} {r.p99_ms:>8} {r.errors:>7}  {r.statuses}")
+
+
+def write_results(path: str, results: list[LoadResult], **extra: Any) -> None:
+    with open(path, "w") as f:
+        json.dump({"commit": git_commit(), **extra, "results": [asdict(r) for r in results]}, f, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url")
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("-X", "--method", default="GET")
+    parser.add_argument("-d", "--data", help="json body")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+
+    body = json.loads(args.data) if args.data else None
+    result = asyncio.run(run_load(args.url, args.requests, args.concurrency, args.method, body))
+    print_results([result])
+    if args.output:
+        write_results(args.output, [result])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Purchase latency of HttpPurchaseEngine against the fake Roblox server.
+
+    python -m bench.http_purchase --purchases 500 --concurrency 10 --latency 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiohttp import ClientSession
+
+from app.schemas import PurchaseData, StatusCodes
+from app.services.purchase import HttpPurchaseEngine
+from bench import fake_roblox
+
+BENCH_TOKEN = "bench-token"
+
+
+async def run(purchases: int, concurrency: int, latency: float) -> dict:
+    state = fake_roblox.FakeRobloxState(latency=latency)
+    fake_roblox.populate(state, count=purchases)
+    runner, base = await fake_roblox.start(state)
+
+    engine = HttpPurchaseEngine(economy_url=f"{base}/economy", auth_url=f"{base}/auth")
+    semaphore = asyncio.Semaphore(concurrency)
+    timings: list[float] = []
+    statuses: dict[StatusCodes, int] = {}
+
+    async def buy(session: ClientSession, game_pass: fake_roblox.FakeGamePass) -> None:
+        purchase_data = PurchaseData(
+            url=f"https://www.roblox.com/game-pass/{game_pass.id}/Pass",
+            price=game_pass.price,
+            tx_id=game_pass.id,
+        )
+        async with semaphore:
+            started = time.perf_counter()
+            signal = await engine.purchase(session, purchase_data, BENCH_TOKEN)
+            timings.append(time.perf_counter() - started)
+        statuses[signal.status_code] = statuses.get(signal.status_code, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(buy(session, x) for x in state.game_passes.values()))
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+
+    timings.sort()
+    return {
+        "purchases": purchases,
+        "rps": round(purchases / elapsed, 1),
+        "p50_ms": round(statistics.median(timings) * 1000, 2),
+        "p99_ms": round(timings[int(len(timings) * 0.99) - 1] * 1000, 2),
+        "statuses": {code.name: count for code, count in statuses.items()},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--purchases", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.purchases, args.concurrency, args.latency))
+    for key, value in result.items():
+        print(f"{key:>10}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Per-message dispatch overhead of run_listeners for the worker handlers.
+
+Listener bodies are stubbed, only their signatures are real,
+so the numbers show the cost of the dispatch itself.
+
+    python -m bench.listeners --messages 100000
+"""
+import argparse
+import asyncio
+import functools
+import time
+
+from app import handlers
+from app.services.helpers import LISTENER_METHODS, compile_listener, run_listeners_async, _get_spec
+
+
+class StubListener:
+    def __init__(self, real) -> None:
+        for key in LISTENER_METHODS:
+            setattr(self, key, self._stub(getattr(real, key)))
+
+    @staticmethod
+    def _stub(func):
+        # __wrapped__ makes the dispatcher inspect the real signature
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def stub(*args, **kwargs):
+                pass
+        else:
+            @functools.wraps(func)
+            def stub(*args, **kwargs):
+                pass
+        return stub
+
+
+async def legacy_run_listeners(data, listeners, key: str = '__call__'):
+    """Dispatch as it was before plans: inspect on every message."""
+    for listener in listeners:
+        func = getattr(listener, key)
+        spec = _get_spec(func)
+        if spec.varkw:
+            workflow = data
+        else:
+            workflow = {k: v for k, v in data.items() if k in set(spec.args + spec.kwonlyargs)}
+        if asyncio.iscoroutinefunction(func):
+            await func(**workflow)
+        else:
+            func(**workflow)
+
+
+def make_workflow() -> dict:
+    data = {
+        "settings": object(),
+        "connection": object(),
+        "driver_pool": object(),
+        "driver": object(),
+        "token_service": object(),
+        "session": object(),
+        "publisher": object(),
+        "purchase_data": object(),
+        "return_signal": object(),
+    }
+    data.update(data=data)
+    return data
+
+
+async def measure(messages: int) -> dict:
+    listeners = [
+        StubListener(handlers.DataHandler()),
+        StubListener(handlers.UrlHandler()),
+        StubListener(handlers.ReturnSignalHandler()),
+    ]
+    plans = [compile_listener(listener) for listener in listeners]
+    data = make_workflow()
+
+    # lower bound: calls with kwargs prepared beforehand
+    prepared = [(plan.func, plan.is_async, plan.project(data)) for plan in plans]
+
+    async def direct(data):
+        for func, is_async, kwargs in prepared:
+            if is_async:
+                await func(**kwargs)
+            else:
+                func(**kwargs)
+
+    results = {}
+    for name, runner, args in (
+            ("direct", direct, ()),
+            ("before", legacy_run_listeners, (listeners,)),
+            ("after", run_listeners_async, (plans,)),
+    ):
+        started = time.perf_counter()
+        for n in range(messages):
+            data["body"] = b'{"url": "https://www.roblox.com/game-pass/1/", "price": 10, "tx_id": %d}' % n
+            await runner(data, *args)
+        results[name] = (time.perf_counter() - started) / messages * 1e6
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+
+    results = asyncio.run(measure(args.messages))
+    direct = results["direct"]
+    for name in ("before", "after"):
+        print(f"{name:>7}: {results[name]:.3f} us/message, dispatch overhead {results[name] - direct:.3f} us")
+
+
+if __name__ == "__main__":
+    main()
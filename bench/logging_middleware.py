@@ -0,0 +1,201 @@
+"""
+Per-request overhead of the logging middleware.
+
+The same tiny Starlette app is called directly through ASGI (no sockets),
+bare, with the old BaseHTTPMiddleware based logger and with the current
+pure ASGI LoggingMiddleware. Log records go to a sink which drops them,
+so formatting and field collection are measured but not the disk.
+The sink uses the default text format like the sinks of the web service
+(app.web.logger), --serialize measures loguru's JSON records instead,
+which alone cost tens of microseconds per record.
+The apps are called in --rounds alternating rounds and the median of
+the rounds is reported. Exits with 1 if the current middleware adds
+more than --threshold-us.
+
+    python -m bench.logging_middleware --requests 20000 --level INFO --sample-rate 1
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import orjson
+from loguru import logger
+from pydantic import BaseModel
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+
+from app.web.middlewares.logger import LoggingMiddleware
+
+EMPTY_VALUE = ""
+PORT = '8000'
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/api/ping",
+    "raw_path": b"/api/ping",
+    "root_path": "",
+    "query_string": b"q=1",
+    "headers": [
+        (b"host", b"localhost:8000"),
+        (b"user-agent", b"bench/1.0"),
+        (b"accept", b"*/*"),
+        (b"accept-encoding", b"gzip, deflate"),
+        (b"referer", b"http://localhost:8000/"),
+        (b"content-type", b"application/json"),
+        (b"cookie", b"session=" + b"x" * 200),
+    ],
+    "client": ("127.0.0.1", 50000),
+    "server": ("127.0.0.1", 8000),
+}
+
+
+class RequestJsonLogSchema(BaseModel):
+    request_uri: str
+    request_referer: str
+    request_protocol: str
+    request_method: str
+    request_path: str
+    request_host: str
+    request_size: int
+    request_content_type: str
+    request_headers: str
+    request_direction: str
+    remote_ip: str
+    remote_port: str
+    duration: float
+
+
+class LegacyLoggingMiddleware(BaseHTTPMiddleware):
+    # the middleware as it was before it became pure ASGI
+    def __init__(self, app, debug: bool = False):
+        super().__init__(app)
+        self.debug = debug
+
+    @staticmethod
+    async def get_protocol(request: Request) -> str:
+        protocol = str(request.scope.get('type', ''))
+        http_version = str(request.scope.get('http_version', ''))
+        if protocol.lower() == 'http' and http_version:
+            return f'{protocol.upper()}/{http_version}'
+        return EMPTY_VALUE
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+        start_time = time.monotonic()
+        exception_object = None
+
+        server: tuple = request.get('server', ('localhost', PORT))
+        request_headers: dict = dict(request.headers.items())
+        try:
+            response = await call_next(request)
+        except Exception as exc:
+            exception_object = exc
+            response = Response(content=str(exc))
+        duration: float = time.monotonic() - start_time
+        duration = float(str(duration)[:4])
+        request_json_fields = RequestJsonLogSchema(
+            request_uri=str(request.url),
+            request_referer=request_headers.get('referer', EMPTY_VALUE),
+            request_protocol=await self.get_protocol(request),
+            request_method=request.method,
+            request_path=request.url.path,
+            request_host=f'{server[0]}:{server[1]}',
+            request_size=int(request_headers.get('content-length', 0)),
+            request_content_type=request_headers.get('content-type', EMPTY_VALUE),
+            request_headers=str(orjson.dumps(request_headers)),
+            request_direction='in',
+            remote_ip=request.client[0],
+            remote_port=str(request.client[1]),
+            duration=duration
+        ).dict()
+        message = (
+            f'{"Error" if exception_object else "Response"} '
+            f'to this request {request.method} \"{str(request.url)}\", '
+            f'in {duration} sec'
+        )
+        logger.info(message, extra={'request_json_fields': request_json_fields, 'to_mask': True})
+        if exception_object:
+            raise exception_object
+        return response
+
+
+async def ping(request: Request) -> PlainTextResponse:
+    return PlainTextResponse("pong")
+
+
+def build_app(middleware: list[Middleware]) -> Starlette:
+    return Starlette(routes=[Route("/api/ping", ping)], middleware=middleware)
+
+
+async def call(app, requests: int) -> float:
+    async def send(message) -> None:
+        pass
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # BaseHTTPMiddleware listens for a disconnect until the response is done
+            await asyncio.Event().wait()
+
+        await app(dict(SCOPE), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+async def measure(requests: int, sample_rate: float, rounds: int) -> dict:
+    apps = {
+        "bare": build_app([]),
+        "legacy": build_app([Middleware(LegacyLoggingMiddleware)]),
+        "asgi": build_app([Middleware(LoggingMiddleware, sample_rate=sample_rate)]),
+    }
+    # warm up lazy imports and router caches
+    for app in apps.values():
+        await call(app, min(requests, 100))
+    # the apps take turns, so a slow moment of the machine doesn't land on one of them only
+    timings: dict[str, list[float]] = {name: [] for name in apps}
+    for _ in range(rounds):
+        for name, app in apps.items():
+            timings[name].append(await call(app, max(requests // rounds, 1)))
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--level", default="INFO")
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--threshold-us", type=float, default=50)
+    parser.add_argument("--serialize", action="store_true")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(lambda message: None, level=args.level, serialize=args.serialize)
+
+    results = asyncio.run(measure(args.requests, args.sample_rate, args.rounds))
+    bare = results["bare"]
+    for name, per_request in results.items():
+        print(f"{name:>8}: {per_request * 1e6:8.1f} us/request, overhead {(per_request - bare) * 1e6:8.1f} us")
+
+    overhead = (results["asgi"] - bare) * 1e6
+    if overhead > args.threshold_us:
+        print(f"LoggingMiddleware overhead {overhead:.1f} us is above {args.threshold_us} us")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
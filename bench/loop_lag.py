@@ -0,0 +1,128 @@
+"""
+Checks that the driver/publisher pattern of the web routes doesn't block
+the event loop while a slow driver and a slow publisher are in use.
+
+A monitor task sleeps for a short interval in a loop and records how
+late it wakes up. A hand-written copy of the route flow (open gamepass
+page, wait for the inventory button, publish) runs once with blocking
+calls and once through the real WebDriverPool and FakeAsyncPublisher,
+which awaits a delay like AsyncBatchPublisher awaits its confirm. The
+routes themselves are not called, so their own blocking calls are not
+caught here. The script exits with 1 if the offloaded lag is above
+--threshold-ms.
+
+    python -m bench.loop_lag --requests 20 --drivers 4 --delay 0.2
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from selenium.common import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.wait import WebDriverWait
+
+from app.services.driver import presence_of_any_text_in_element
+from app.web.driver_pool import WebDriverPool
+from bench.fakes import FakeDriver, FakeMessageSender, FakeAsyncPublisher
+from bench.http_load import percentile
+
+URL = "https://www.roblox.com/game-pass/1/"
+LOCATOR = (By.CSS_SELECTOR, ".inventory-button")
+MONITOR_INTERVAL = 0.005
+
+
+async def monitor(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(MONITOR_INTERVAL)
+        lags.append(time.perf_counter() - started - MONITOR_INTERVAL)
+
+
+async def blocking(requests: int, delay: float, wait_timeout: float, publish_delay: float) -> None:
+    driver = FakeDriver(delay=delay)
+    publisher = FakeMessageSender(delay=publish_delay)
+
+    async def handle(n: int) -> None:
+        # what the routes did before: selenium and pika called right on the loop
+        driver.get(URL)
+        try:
+            WebDriverWait(driver, wait_timeout).until(presence_of_any_text_in_element(LOCATOR))
+        except TimeoutException:
+            pass
+        publisher.send_message({"n": n})
+
+    await asyncio.gather(*(handle(n) for n in range(requests)))
+
+
+async def offloaded(requests: int, drivers: int, delay: float, wait_timeout: float, publish_delay: float) -> None:
+    pool = WebDriverPool(lambda: FakeDriver(delay=delay), size=drivers)
+    await pool.start()
+    # the confirm of AsyncBatchPublisher is awaited, the loop keeps running meanwhile
+    publisher = FakeAsyncPublisher(delay=publish_delay)
+    await publisher.start()
+
+    async def handle(n: int) -> None:
+        async with pool.lease() as driver:
+            await driver.get(URL)
+            await driver.wait_for_text(LOCATOR, wait_timeout)
+        await publisher.publish({"n": n})
+
+    try:
+        await asyncio.gather(*(handle(n) for n in range(requests)))
+    finally:
+        await publisher.close()
+        await pool.close()
+
+
+async def measure(scenario) -> dict:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(monitor(stop, lags))
+
+    started = time.perf_counter()
+    await scenario
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await watcher
+    lags.sort()
+    return {
+        "elapsed": round(elapsed, 3),
+        "lag_p50_ms": round(percentile(lags, 0.5) * 1000, 3),
+        "lag_p99_ms": round(percentile(lags, 0.99) * 1000, 3),
+        "lag_max_ms": round(lags[-1] * 1000 if lags else 0.0, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--drivers", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--wait-timeout", type=float, default=0.3)
+    parser.add_argument("--publish-delay", type=float, default=0.05)
+    parser.add_argument("--threshold-ms", type=float, default=50)
+    parser.add_argument("--skip-blocking", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    if not args.skip_blocking:
+        results["blocking"] = asyncio.run(measure(
+            blocking(args.requests, args.delay, args.wait_timeout, args.publish_delay)))
+    results["offloaded"] = asyncio.run(measure(
+        offloaded(args.requests, args.drivers, args.delay, args.wait_timeout, args.publish_delay)))
+
+    for name, result in results.items():
+        print(name)
+        for key, value in result.items():
+            print(f"{key:>16}: {value}")
+
+    lag = results["offloaded"]["lag_max_ms"]
+    if lag > args.threshold_ms:
+        print(f"Loop lag {lag} ms is above {args.threshold_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()